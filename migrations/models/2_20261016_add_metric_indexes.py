@@ -0,0 +1,19 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        -- Composite indexes for metrics reports (filter by type and time range,
+        -- per-user activity, and per-meal view counts)
+        CREATE INDEX IF NOT EXISTS "idx_metrics_type_timestamp" ON "metrics" ("metric_type", "timestamp");
+        CREATE INDEX IF NOT EXISTS "idx_metrics_user_timestamp" ON "metrics" ("user_id", "timestamp");
+        CREATE INDEX IF NOT EXISTS "idx_metrics_entity_type" ON "metrics" ("entity_id", "metric_type");
+    """
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP INDEX IF EXISTS "idx_metrics_entity_type";
+        DROP INDEX IF EXISTS "idx_metrics_user_timestamp";
+        DROP INDEX IF EXISTS "idx_metrics_type_timestamp";
+    """
@@ -0,0 +1,28 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "metric_daily_rollups" (
+            "id" SERIAL NOT NULL PRIMARY KEY,
+            "date" DATE NOT NULL,
+            "metric_type" VARCHAR(19) NOT NULL,
+            "count" INT NOT NULL DEFAULT 0,
+            UNIQUE("date", "metric_type")
+        );
+        
+        -- Backfill from existing metrics (days in Almaty time, UTC+5)
+        INSERT INTO "metric_daily_rollups" ("date", "metric_type", "count")
+        SELECT DATE("timestamp" AT TIME ZONE 'Etc/GMT-5'), "metric_type", COUNT(*)
+        FROM "metrics"
+        GROUP BY 1, 2
+        ON CONFLICT ("date", "metric_type") DO UPDATE SET "count" = EXCLUDED."count";
+        
+        COMMENT ON TABLE "metric_daily_rollups" IS 'Daily metric counts per type, refreshed periodically from the metrics table.';
+    """
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "metric_daily_rollups";
+    """
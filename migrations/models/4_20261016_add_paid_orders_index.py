@@ -0,0 +1,16 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        -- Partial index over paid and completed orders only, used for revenue
+        -- (GMV) and completed-order lookups joined to meals
+        CREATE INDEX IF NOT EXISTS "idx_orders_paid_meal" ON "orders" ("meal_id", "quantity")
+            WHERE "status" IN ('paid', 'completed');
+    """
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP INDEX IF EXISTS "idx_orders_paid_meal";
+    """
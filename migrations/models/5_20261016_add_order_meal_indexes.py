@@ -0,0 +1,19 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        -- Indexes for dashboard filters: orders by status, currently listed
+        -- meals, and metrics by time range regardless of type
+        CREATE INDEX IF NOT EXISTS "idx_orders_status" ON "orders" ("status");
+        CREATE INDEX IF NOT EXISTS "idx_meals_active_quantity_pickup" ON "meals" ("is_active", "quantity", "pickup_end_time");
+        CREATE INDEX IF NOT EXISTS "idx_metrics_timestamp" ON "metrics" ("timestamp");
+    """
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP INDEX IF EXISTS "idx_metrics_timestamp";
+        DROP INDEX IF EXISTS "idx_meals_active_quantity_pickup";
+        DROP INDEX IF EXISTS "idx_orders_status";
+    """
@@ -13,11 +13,17 @@ from aiogram.types import (
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram import __version__ as aiogram_version
+from aiohttp import ClientSession, TCPConnector, hdrs
+from aiohttp.http import SERVER_SOFTWARE
+from tortoise.transactions import in_transaction
 from typing import Dict
 
 from .config import (
     BOT_TOKEN, ADMIN_CHAT_ID, ALMATY_TIMEZONE, 
     RATE_LIMIT_GENERAL, RATE_LIMIT_REGISTER, RATE_LIMIT_ADD_MEAL, RATE_LIMIT_PAYMENT,
+    HTTP_POOL_LIMIT, HTTP_DNS_CACHE_TTL,
     TELEGRAM_PAYMENT_PROVIDER_TOKEN, TELEGRAM_PAYMENT_CURRENCY, TELEGRAM_PAYMENT_ENABLED,
     get_current_almaty_time
 )
@@ -27,17 +33,38 @@ from .tasks import scheduled_tasks
 from .metrics import (
     track_metric, get_metrics_report, get_metrics_dashboard_data, get_most_viewed_meals,
     get_peak_hours_analysis, get_user_activity_patterns, get_conversion_funnel_detailed,
-    get_vendor_performance_metrics
+    get_vendor_performance_metrics, start_metric_writer, stop_metric_writer
 )
 from .security import rate_limit
-from .payment import payment_gateway
+from .payment import payment_gateway, decrement_meal_quantity
 from src.earnings import calculate_and_record_earnings
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
+class PooledAiohttpSession(AiohttpSession):
+    """AiohttpSession whose connection pool and DNS cache are sized from the config"""
+    
+    async def create_session(self) -> ClientSession:
+        """Create the client session with our own connector on first use (or after close)"""
+        if self._session is None or self._session.closed:
+            self._session = ClientSession(
+                connector=TCPConnector(
+                    limit=HTTP_POOL_LIMIT,
+                    ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+                    enable_cleanup_closed=True
+                ),
+                headers={hdrs.USER_AGENT: f"{SERVER_SOFTWARE} aiogram/{aiogram_version}"}
+            )
+        return self._session
+
+
+# Shared HTTP session for all Bot API calls, so TCP/TLS connections and
+# DNS lookups are reused instead of being re-established per request
+http_session = PooledAiohttpSession()
+
 # Initialize bot and dispatcher with FSM storage
-bot = Bot(token=BOT_TOKEN)
+bot = Bot(token=BOT_TOKEN, session=http_session)
 storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
 
@@ -1468,9 +1495,19 @@ async def process_payment_webhook(webhook_data, signature=None):
             logging.info(f"Order {order.id} already processed, status: {order.status}")
             return True
         
-        # Update the order status
+        # Update the order status and meal quantity in one transaction,
+        # unless a concurrent webhook already processed the order
+        async with in_transaction() as connection:
+            updated = await Order.filter(id=order.id, status=OrderStatus.PENDING).using_db(connection).update(
+                status=OrderStatus.PAID
+            )
+            if updated:
+                await decrement_meal_quantity(order.meal_id, order.quantity, connection)
+        
+        if not updated:
+            logging.info(f"Order {order.id} already processed by another webhook")
+            return True
         order.status = OrderStatus.PAID
-        await order.save()
         
         # Track payment metric
         await track_metric(
@@ -1486,11 +1523,6 @@ async def process_payment_webhook(webhook_data, signature=None):
             }
         )
         
-        # Update the meal quantity
-        meal = order.meal
-        meal.quantity = max(0, meal.quantity - order.quantity)
-        await meal.save()
-        
         # Send notifications
         await send_order_notifications(order.id)
         
@@ -2044,14 +2076,25 @@ async def main():
     from src.earnings import initialize_commission_structure
     await initialize_commission_structure()
     
+    periodic_task = None
     try:
+        # Start writing metrics in batches
+        start_metric_writer()
+        
         # Create background task for deactivating expired meals
-        asyncio.create_task(periodic_task_runner())
+        periodic_task = asyncio.create_task(periodic_task_runner())
         
         # Start the bot
         await dp.start_polling(bot)
     finally:
-        # Close database connection when done
+        # Stop the scheduled tasks so none is left mid-query when the database closes
+        if periodic_task is not None:
+            periodic_task.cancel()
+            await asyncio.gather(periodic_task, return_exceptions=True)
+        
+        # Write queued metrics, then close the shared HTTP session and database connection
+        await stop_metric_writer()
+        await bot.session.close()
         await close_db()
 
 async def periodic_task_runner():
@@ -2064,6 +2107,9 @@ async def periodic_task_runner():
             # Run task to cleanup expired orders
             await scheduled_tasks["cleanup_expired_orders"]()
             
+            # Run task to refresh the daily metric rollups
+            await scheduled_tasks["refresh_metric_rollups"]()
+            
             # Wait for 10 minutes before checking again
             await asyncio.sleep(600)
         except Exception as e:
@@ -2558,15 +2604,15 @@ async def cmd_vendor_earnings(message: Message):
         from src.models import VendorEarnings, Order, OrderStatus
         
         # Debug: Check all earnings for this vendor
-        all_earnings = await VendorEarnings.filter(vendor=vendor).prefetch_related('order').all()
-        completed_orders = await Order.filter(meal__vendor=vendor, status=OrderStatus.COMPLETED).all()
+        all_earnings = await VendorEarnings.filter(vendor=vendor).values("order_id", "net_amount", "is_paid_out")
+        completed_orders_count = await Order.filter(meal__vendor=vendor, status=OrderStatus.COMPLETED).count()
         
         logging.info(f"Debug earnings for vendor {vendor.name} (ID: {vendor.id}):")
         logging.info(f"  Total earnings records: {len(all_earnings)}")
-        logging.info(f"  Completed orders: {len(completed_orders)}")
+        logging.info(f"  Completed orders: {completed_orders_count}")
         
         for earning in all_earnings:
-            logging.info(f"  Earning: Order {earning.order.id}, Net: {earning.net_amount}, Paid out: {earning.is_paid_out}")
+            logging.info(f"  Earning: Order {earning['order_id']}, Net: {earning['net_amount']}, Paid out: {earning['is_paid_out']}")
         
         # Get unpaid earnings
         unpaid_summary = await get_vendor_unpaid_earnings(vendor)
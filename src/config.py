@@ -30,6 +30,14 @@ RATE_LIMIT_ADD_MEAL = int(os.getenv("RATE_LIMIT_ADD_MEAL", "5"))  # Meal additio
 RATE_LIMIT_PAYMENT = int(os.getenv("RATE_LIMIT_PAYMENT", "3"))  # Payment attempts per minute
 WEBHOOK_RATE_LIMIT = int(os.getenv("WEBHOOK_RATE_LIMIT", "30"))  # Webhook requests per 10 seconds
 
+# Payment webhook processing
+PAYMENT_WEBHOOK_QUEUE_SIZE = int(os.getenv("PAYMENT_WEBHOOK_QUEUE_SIZE", "10000"))  # Max webhooks waiting to be processed
+PAYMENT_WEBHOOK_WORKERS = int(os.getenv("PAYMENT_WEBHOOK_WORKERS", "4"))  # Concurrent webhook processors
+
+# Outbound HTTP connection pool (shared by all Telegram Bot API calls)
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))  # Max simultaneous connections
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))  # Seconds to cache DNS lookups
+
 # Bot configuration
 BOT_TOKEN = os.getenv("BOT_TOKEN", "test_token" if TESTING else None)
 if not BOT_TOKEN and not TESTING:
@@ -73,6 +81,8 @@ DEFAULT_LANGUAGE = "ru"
 # Use a fixed UTC+5 timezone instead of relying on the named timezone
 TIMEZONE_OFFSET_HOURS = 5  # Almaty is UTC+5
 ALMATY_TIMEZONE = pytz.FixedOffset(TIMEZONE_OFFSET_HOURS * 60)  # Convert hours to minutes
+# Same offset as a tz database name for use in SQL (POSIX sign is inverted: Etc/GMT-5 is UTC+5)
+ALMATY_TIMEZONE_NAME = f"Etc/GMT-{TIMEZONE_OFFSET_HOURS}"
 
 def get_current_almaty_time():
     """Get current time in Almaty timezone"""
@@ -124,5 +134,5 @@ TORTOISE_ORM = {
         },
     },
     "use_tz": True,
-    "timezone": f"Etc/GMT-{TIMEZONE_OFFSET_HOURS}"  # Etc/GMT-5 is UTC+5
+    "timezone": ALMATY_TIMEZONE_NAME  # Etc/GMT-5 is UTC+5
 }
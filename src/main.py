@@ -5,13 +5,17 @@ from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_applicati
 from aiohttp import web
 import aiohttp_cors
 import ssl
+import signal
 
 from .config import (
     BOT_TOKEN, WEBHOOK_MODE, WEBHOOK_URL, WEBHOOK_PATH, 
-    WEBAPP_HOST, WEBAPP_PORT, SSL_CERT_PATH, SSL_KEY_PATH, USE_SSL
+    WEBAPP_HOST, WEBAPP_PORT, SSL_CERT_PATH, SSL_KEY_PATH, USE_SSL,
+    PAYMENT_WEBHOOK_QUEUE_SIZE, PAYMENT_WEBHOOK_WORKERS
 )
 from .db import init_db, close_db
-from .bot import dp, bot, process_payment_webhook
+from .bot import dp, bot, process_payment_webhook, periodic_task_runner
+from .payment import payment_gateway
+from .metrics import start_metric_writer, stop_metric_writer
 from .security import webhook_security_middleware, start_security_tasks, rate_limiter
 
 # Configure logging
@@ -24,26 +28,114 @@ app = web.Application()
 # Setup webhook payment route
 async def handle_payment_webhook(request):
     """
-    Handle payment webhook requests from the payment gateway
+    Handle payment webhook requests from the payment gateway.
+    
+    The signature and payload are checked here and the webhook is queued;
+    payment_webhook_worker tasks do the actual processing so the gateway
+    gets an answer without waiting on the database.
     """
     try:
         # Get signature from header if available
         signature = request.headers.get('X-Signature', None)
         
+        # The signature covers the raw body, so read it before parsing
+        body = await request.read()
+    except Exception as e:
+        logger.error(f"Error reading payment webhook: {e}")
+        return web.json_response({"status": "error", "message": str(e)}, status=400)
+    
+    # Reject forged webhooks before they reach the queue
+    if not payment_gateway.verify_webhook_signature(body, signature):
+        logger.warning("Payment webhook with invalid signature rejected")
+        return web.json_response({"status": "error", "message": "Invalid signature"}, status=401)
+    
+    try:
         # Get JSON data from request
         webhook_data = await request.json()
-        
-        # Process the webhook
-        success = await process_payment_webhook(webhook_data, signature)
-        
-        if success:
-            return web.json_response({"status": "success"})
-        else:
-            return web.json_response({"status": "error", "message": "Failed to process webhook"}, status=400)
-    
     except Exception as e:
-        logger.error(f"Error processing payment webhook: {e}")
+        logger.error(f"Error parsing payment webhook: {e}")
         return web.json_response({"status": "error", "message": str(e)}, status=400)
+    
+    # Workers look the order up by its payment, so a webhook without one is useless
+    if not isinstance(webhook_data, dict) or not webhook_data.get("payment_id"):
+        logger.error(f"Payment webhook missing payment_id: {webhook_data}")
+        return web.json_response({"status": "error", "message": "Missing payment_id"}, status=400)
+    
+    # Only completed payments change an order; acknowledge other statuses so
+    # the gateway doesn't redeliver them, but don't queue them
+    if webhook_data.get("status") != "completed":
+        logger.info(f"Ignoring payment webhook with status {webhook_data.get('status')}: {webhook_data['payment_id']}")
+        return web.json_response({"status": "ignored"})
+    
+    # Queue the webhook for background processing
+    try:
+        request.app['payment_webhook_queue'].put_nowait((webhook_data, signature))
+    except asyncio.QueueFull:
+        logger.warning("Payment webhook queue is full, rejecting webhook")
+        return web.json_response({"status": "error", "message": "Webhook queue is full"}, status=503)
+    
+    return web.json_response({"status": "success"})
+
+
+async def payment_webhook_worker(queue):
+    """Process queued payment webhooks until cancelled"""
+    while True:
+        webhook_data, signature = await queue.get()
+        try:
+            success = await process_payment_webhook(webhook_data, signature)
+            if not success:
+                logger.error(f"Failed to process payment webhook: {webhook_data}")
+        except Exception as e:
+            logger.error(f"Error processing payment webhook: {e}")
+        finally:
+            queue.task_done()
+
+
+async def start_payment_webhook_workers(app):
+    """Create the payment webhook queue and its worker tasks"""
+    queue = asyncio.Queue(maxsize=PAYMENT_WEBHOOK_QUEUE_SIZE)
+    app['payment_webhook_queue'] = queue
+    app['payment_webhook_workers'] = [
+        asyncio.create_task(payment_webhook_worker(queue))
+        for _ in range(PAYMENT_WEBHOOK_WORKERS)
+    ]
+
+
+async def stop_payment_webhook_workers(app, timeout=10):
+    """Let the workers drain the queue, then cancel them"""
+    queue = app.get('payment_webhook_queue')
+    workers = app.get('payment_webhook_workers', [])
+    if queue is not None:
+        try:
+            await asyncio.wait_for(queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Dropping {queue.qsize()} unprocessed payment webhooks on shutdown")
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+
+
+# Background task running the scheduled jobs, see start_periodic_tasks
+_periodic_task = None
+
+
+def start_periodic_tasks():
+    """Start the background task running the scheduled jobs"""
+    global _periodic_task
+    if _periodic_task is None or _periodic_task.done():
+        _periodic_task = asyncio.create_task(periodic_task_runner())
+
+
+async def stop_periodic_tasks():
+    """Cancel the scheduled jobs and wait until any job in progress has stopped"""
+    global _periodic_task
+    task = _periodic_task
+    if task is None:
+        return
+    
+    _periodic_task = None
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
 
 
 async def on_startup(app=None):
@@ -54,6 +146,16 @@ async def on_startup(app=None):
     # Start security background tasks
     await start_security_tasks()
     
+    # Start writing metrics in batches
+    start_metric_writer()
+    
+    # Run scheduled tasks (expired meals/orders, metric rollups) in the background
+    start_periodic_tasks()
+    
+    # Start payment webhook workers when serving the web application
+    if app is not None:
+        await start_payment_webhook_workers(app)
+    
     # Set webhook if in webhook mode
     if WEBHOOK_MODE and WEBHOOK_URL:
         await bot.set_webhook(WEBHOOK_URL)
@@ -67,6 +169,19 @@ async def on_shutdown(app=None):
         await bot.delete_webhook()
         logger.info("Webhook removed")
     
+    # Finish queued payment webhooks before the database goes away
+    if app is not None:
+        await stop_payment_webhook_workers(app)
+    
+    # Stop the scheduled tasks so none is left mid-query when the database closes
+    await stop_periodic_tasks()
+    
+    # Write any queued metrics before the database goes away
+    await stop_metric_writer()
+    
+    # Close the shared HTTP session used for Bot API calls
+    await bot.session.close()
+    
     # Close database connection
     await close_db()
 
@@ -128,16 +243,29 @@ async def main():
                 ssl_context.load_cert_chain(SSL_CERT_PATH, SSL_KEY_PATH)
                 logger.info("SSL enabled for webhook server")
             
+            # Stop serving as soon as the process is asked to terminate
+            stop_event = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                try:
+                    loop.add_signal_handler(sig, stop_event.set)
+                except NotImplementedError:
+                    # Signal handlers are not supported on this platform (e.g. Windows)
+                    pass
+            
             # Use runner to properly handle application lifecycle
             runner = web.AppRunner(app)
             await runner.setup()
-            site = web.TCPSite(runner, host=WEBAPP_HOST, port=int(WEBAPP_PORT), ssl_context=ssl_context)
-            
-            await site.start()
-            
-            # Keep the server running
-            while True:
-                await asyncio.sleep(3600)  # Sleep for 1 hour
+            try:
+                site = web.TCPSite(runner, host=WEBAPP_HOST, port=int(WEBAPP_PORT), ssl_context=ssl_context)
+                await site.start()
+                
+                # Keep the server running until a shutdown signal arrives
+                await stop_event.wait()
+                logger.info("Shutdown signal received, stopping webhook server")
+            finally:
+                # Runs the app's on_shutdown hooks, which close the DB connection
+                await runner.cleanup()
                 
         else:
             # Polling mode for local development
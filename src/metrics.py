@@ -1,17 +1,87 @@
+import asyncio
 import logging
 import json
-from datetime import datetime, timedelta
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
 from typing import Dict, List, Optional, Union, Tuple
 
-from tortoise.functions import Count, Sum, Avg
-from tortoise.expressions import Q
+from tortoise.functions import Count, Sum, Avg, Max
+from tortoise.expressions import F, Q, RawSQL
 
-from .models import Metric, MetricType, Meal, Order, OrderStatus, Vendor, VendorStatus
-from .config import ALMATY_TIMEZONE
+from .models import (
+    Metric, MetricDailyRollup, MetricType, Meal, Order, OrderStatus, Vendor, VendorStatus
+)
+from .config import ALMATY_TIMEZONE, ALMATY_TIMEZONE_NAME, TIMEZONE_OFFSET_HOURS
 
 
 logger = logging.getLogger(__name__)
 
+# How long a computed dashboard is reused, in seconds
+DASHBOARD_CACHE_TTL = 30
+
+# (monotonic time computed, dashboard data) of the last successful dashboard
+_dashboard_cache: Optional[Tuple[float, Dict]] = None
+
+# Metric events are queued and written in batches by a background task
+METRIC_QUEUE_SIZE = 10000  # Max events waiting to be written
+METRIC_BATCH_SIZE = 200  # Max events per bulk insert
+METRIC_FLUSH_INTERVAL = 0.1  # Seconds to collect events before writing a batch
+
+_metric_queue: asyncio.Queue = asyncio.Queue(maxsize=METRIC_QUEUE_SIZE)
+_metric_writer_task: Optional[asyncio.Task] = None
+
+# Parts of a metric's Almaty local time as SQL, per database dialect, so metrics
+# can be grouped by local day or hour in the database. SQLite stores the
+# timestamps as text with their UTC offset, which its date functions apply.
+_PG_LOCAL_TIMESTAMP = f"\"timestamp\" AT TIME ZONE '{ALMATY_TIMEZONE_NAME}'"
+_SQLITE_LOCAL_OFFSET = f"'+{TIMEZONE_OFFSET_HOURS} hours'"
+_LOCAL_TIME_SQL = {
+    "postgres": {
+        "day": f"DATE({_PG_LOCAL_TIMESTAMP})",
+        "hour": f"CAST(EXTRACT(HOUR FROM {_PG_LOCAL_TIMESTAMP}) AS INTEGER)",
+        "weekday": f"CAST(EXTRACT(ISODOW FROM {_PG_LOCAL_TIMESTAMP}) AS INTEGER) - 1",
+    },
+    "sqlite": {
+        "day": f"DATE(\"timestamp\", {_SQLITE_LOCAL_OFFSET})",
+        "hour": f"CAST(STRFTIME('%H', \"timestamp\", {_SQLITE_LOCAL_OFFSET}) AS INTEGER)",
+        # %w counts from Sunday, shift it so Monday is 0 like ISODOW - 1
+        "weekday": f"(CAST(STRFTIME('%w', \"timestamp\", {_SQLITE_LOCAL_OFFSET}) AS INTEGER) + 6) % 7",
+    },
+}
+
+
+def _local_time_sql(part: str) -> RawSQL:
+    """SQL for a part of a metric's Almaty local time: "day" as a date,
+    "hour" as 0-23 or "weekday" as 0-6 from Monday"""
+    return RawSQL(_LOCAL_TIME_SQL[Metric._meta.db.capabilities.dialect][part])
+
+
+def conversion_percentage(converted: int, total: int) -> float:
+    """Percentage of total that converted, rounded to 2 places (0 when total is 0)"""
+    return round(converted / total * 100, 2) if total > 0 else 0
+
+
+async def get_order_totals() -> Dict[str, Tuple[int, float]]:
+    """
+    Aggregate orders per status in the database.
+    
+    The order value (quantity * meal price) is summed in SQL, so one row
+    per status is fetched.
+    
+    Returns:
+        Dictionary mapping order status values to (order count, total order value)
+    """
+    rows = await Order.annotate(
+        count=Count("id"),
+        total=Sum(F("quantity") * F("meal__price"))
+    ).group_by("status").values("status", "count", "total")
+    
+    return {
+        OrderStatus(row["status"]).value: (row["count"], float(row["total"] or 0))
+        for row in rows
+    }
+
 
 async def track_metric(
     metric_type: MetricType,
@@ -19,10 +89,15 @@ async def track_metric(
     entity_id: Optional[int] = None,
     user_id: Optional[int] = None,
     metadata: Optional[Dict] = None
-) -> Metric:
+) -> Optional[Metric]:
     """
     Track a metric event in the database.
     
+    While the background metric writer is running the event is queued and
+    written in bulk shortly after, so the returned Metric has no id yet;
+    callers must not rely on it being saved. Without a running writer, or
+    when the queue is full, the event is written immediately.
+    
     Args:
         metric_type: Type of metric being tracked
         value: Numeric value for the metric (default is 1.0 for count-based metrics)
@@ -31,16 +106,30 @@ async def track_metric(
         metadata: Optional additional contextual data as a dictionary
     
     Returns:
-        The created Metric object
+        The Metric object (unsaved with id None if it was queued), or None if tracking failed
     """
     try:
-        metric = await Metric.create(
+        metric = Metric(
             metric_type=metric_type,
             value=value,
             entity_id=entity_id,
             user_id=user_id,
-            metadata=metadata
+            metadata=metadata,
+            # Record when the event happened, not when its batch is written
+            timestamp=datetime.now(ALMATY_TIMEZONE)
         )
+        
+        queued = False
+        if _metric_writer_task is not None:
+            try:
+                _metric_queue.put_nowait(metric)
+                queued = True
+            except asyncio.QueueFull:
+                logger.warning("Metric queue is full, writing metric directly")
+        
+        if not queued:
+            await metric.save()
+        
         logger.info(f"Tracked metric: {metric_type.value}, value: {value}, entity_id: {entity_id}, user_id: {user_id}")
         return metric
     except Exception as e:
@@ -49,6 +138,161 @@ async def track_metric(
         return None
 
 
+async def _write_metrics(batch: List[Metric]):
+    """Insert a batch of queued metrics with a single bulk insert"""
+    try:
+        await Metric.bulk_create(batch)
+    except Exception as e:
+        # Fall back to one insert per metric, so one bad event doesn't drop the whole batch
+        logger.error(f"Error writing {len(batch)} metrics in bulk, writing them one by one: {str(e)}")
+        for metric in batch:
+            try:
+                await metric.save()
+            except Exception as e:
+                logger.error(f"Error writing metric {metric.metric_type.value}: {str(e)}")
+    finally:
+        for _ in batch:
+            _metric_queue.task_done()
+
+
+async def _metric_writer():
+    """Write queued metrics in batches until cancelled"""
+    while True:
+        batch = [await _metric_queue.get()]
+        
+        # Give events arriving at the same time a chance to join this batch
+        await asyncio.sleep(METRIC_FLUSH_INTERVAL)
+        while len(batch) < METRIC_BATCH_SIZE and not _metric_queue.empty():
+            batch.append(_metric_queue.get_nowait())
+        
+        await _write_metrics(batch)
+
+
+def start_metric_writer():
+    """Start the background task that writes queued metrics in bulk"""
+    global _metric_writer_task
+    if _metric_writer_task is None or _metric_writer_task.done():
+        _metric_writer_task = asyncio.create_task(_metric_writer())
+
+
+async def stop_metric_writer(timeout: float = 10):
+    """Write any queued metrics and stop the background writer"""
+    global _metric_writer_task
+    task = _metric_writer_task
+    if task is None:
+        return
+    
+    # New events are written directly from now on
+    _metric_writer_task = None
+    
+    try:
+        await asyncio.wait_for(_metric_queue.join(), timeout=timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"Timed out writing queued metrics, {_metric_queue.qsize()} left")
+    
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+async def count_metrics_by_type(query: Q) -> Dict[str, int]:
+    """
+    Count metrics matching a query, grouped by metric type.
+    
+    Args:
+        query: Filter applied to the metrics before grouping
+    
+    Returns:
+        Dictionary mapping metric type values to their counts
+    """
+    rows = await Metric.filter(query).annotate(
+        count=Count("id")
+    ).group_by("metric_type").values("metric_type", "count")
+    
+    # metric_type may come back as a MetricType member or a plain string
+    return {MetricType(row["metric_type"]).value: row["count"] for row in rows}
+
+
+async def get_latest_rollup_day() -> Optional[date]:
+    """
+    Get the newest day in the daily rollup table.
+    
+    The rollup refresh recounts from the day before this one onwards, so
+    every earlier day has its final counts; this day itself may still be
+    partial.
+    
+    Returns:
+        The newest rolled-up Almaty calendar day, or None if there are no rollups
+    """
+    return await MetricDailyRollup.all().order_by("-date").first().values_list("date", flat=True)
+
+
+async def count_metrics_in_range(
+    start_date: datetime,
+    end_date: datetime,
+    metric_types: Optional[List[MetricType]] = None
+) -> Dict[str, int]:
+    """
+    Count metrics per type between two moments (inclusive).
+    
+    Whole days that are already fully rolled up are read from the daily
+    rollup table; the partial day at the start of the range and every day
+    from the newest rolled-up day on are counted from the raw metrics, so
+    days the rollup refresh hasn't caught up with yet are still counted.
+    
+    Args:
+        start_date: Start of the range (timezone-aware)
+        end_date: End of the range (timezone-aware)
+        metric_types: Optional list of metric types to include (defaults to all)
+    
+    Returns:
+        Dictionary mapping metric type values to their counts
+    """
+    type_query = Q(metric_type__in=metric_types) if metric_types else Q()
+    
+    # Full days covered by the range, up to (not including) today and the
+    # newest rolled-up day, which may still be missing events
+    start_local = start_date.astimezone(ALMATY_TIMEZONE)
+    first_day = start_local.date()
+    if start_local.time() != datetime.min.time():
+        first_day += timedelta(days=1)
+    today = datetime.now(ALMATY_TIMEZONE).date()
+    end_day = min(end_date.astimezone(ALMATY_TIMEZONE).date(), today)
+    latest_rollup_day = await get_latest_rollup_day()
+    
+    if latest_rollup_day is None or min(end_day, latest_rollup_day) <= first_day:
+        # No complete day in the range, count everything from the raw metrics
+        return await count_metrics_by_type(
+            Q(timestamp__gte=start_date) & Q(timestamp__lte=end_date) & type_query
+        )
+    
+    end_day = min(end_day, latest_rollup_day)
+    first_day_start = ALMATY_TIMEZONE.localize(datetime.combine(first_day, datetime.min.time()))
+    end_day_start = ALMATY_TIMEZONE.localize(datetime.combine(end_day, datetime.min.time()))
+    
+    rollup_query = MetricDailyRollup.filter(date__gte=first_day, date__lt=end_day)
+    if metric_types:
+        rollup_query = rollup_query.filter(metric_type__in=metric_types)
+    
+    head_counts, rollup_rows, tail_counts = await asyncio.gather(
+        count_metrics_by_type(
+            Q(timestamp__gte=start_date) & Q(timestamp__lt=first_day_start) & type_query
+        ),
+        rollup_query.annotate(
+            total=Sum("count")
+        ).group_by("metric_type").values("metric_type", "total"),
+        count_metrics_by_type(
+            Q(timestamp__gte=end_day_start) & Q(timestamp__lte=end_date) & type_query
+        )
+    )
+    
+    type_counts = Counter(head_counts)
+    type_counts.update(tail_counts)
+    for row in rollup_rows:
+        type_counts[MetricType(row["metric_type"]).value] += int(row["total"])
+    
+    return dict(type_counts)
+
+
 async def get_metrics_report(
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
@@ -78,16 +322,6 @@ async def get_metrics_report(
         # Make timezone-aware if it's not already
         start_date = start_date.replace(tzinfo=ALMATY_TIMEZONE)
     
-    # Create base query with date filtering
-    base_query = Q(timestamp__gte=start_date) & Q(timestamp__lte=end_date)
-    
-    # Add metric type filtering if specified
-    if metric_types:
-        metric_type_filter = Q(metric_type=metric_types[0])
-        for m_type in metric_types[1:]:
-            metric_type_filter |= Q(metric_type=m_type)
-        base_query &= metric_type_filter
-    
     # Collect report data
     report = {
         "time_period": {
@@ -98,33 +332,36 @@ async def get_metrics_report(
         "details": {}
     }
     
-    # Get counts for each metric type
-    all_metrics = await Metric.filter(base_query).all()
-    type_counts = {}
-    for metric in all_metrics:
-        metric_type = metric.metric_type.value
-        if metric_type not in type_counts:
-            type_counts[metric_type] = 0
-        type_counts[metric_type] += 1
+    # The report sections don't depend on each other, so run their queries concurrently
+    type_counts, overview_engagement, daily_sales = await asyncio.gather(
+        count_metrics_in_range(start_date, end_date, metric_types),
+        _calc_overview_and_engagement(end_date),
+        _calc_daily_sales(start_date, end_date),
+        return_exceptions=True
+    )
+    
+    # Counts for each metric type are required by the sections below
+    if isinstance(type_counts, Exception):
+        raise type_counts
     
     report["summary"]["counts"] = type_counts
     
     # Calculate key conversion rates
     try:
         # Browse to purchase conversion
-        browse_count = await Metric.filter(base_query & Q(metric_type=MetricType.MEAL_BROWSE)).count()
-        view_count = await Metric.filter(base_query & Q(metric_type=MetricType.MEAL_VIEW)).count()
-        order_created_count = await Metric.filter(base_query & Q(metric_type=MetricType.ORDER_CREATED)).count()
-        order_paid_count = await Metric.filter(base_query & Q(metric_type=MetricType.ORDER_PAID)).count()
-        order_completed_count = await Metric.filter(base_query & Q(metric_type=MetricType.ORDER_COMPLETED)).count()
+        browse_count = type_counts.get(MetricType.MEAL_BROWSE.value, 0)
+        view_count = type_counts.get(MetricType.MEAL_VIEW.value, 0)
+        order_created_count = type_counts.get(MetricType.ORDER_CREATED.value, 0)
+        order_paid_count = type_counts.get(MetricType.ORDER_PAID.value, 0)
+        order_completed_count = type_counts.get(MetricType.ORDER_COMPLETED.value, 0)
         
-        # Calculate conversion rates (avoiding division by zero)
+        # Calculate conversion rates
         report["summary"]["conversion"] = {
-            "browse_to_view": round((view_count / browse_count * 100) if browse_count > 0 else 0, 2),
-            "view_to_order": round((order_created_count / view_count * 100) if view_count > 0 else 0, 2),
-            "order_to_payment": round((order_paid_count / order_created_count * 100) if order_created_count > 0 else 0, 2),
-            "payment_to_completion": round((order_completed_count / order_paid_count * 100) if order_paid_count > 0 else 0, 2),
-            "overall_browse_to_purchase": round((order_paid_count / browse_count * 100) if browse_count > 0 else 0, 2)
+            "browse_to_view": conversion_percentage(view_count, browse_count),
+            "view_to_order": conversion_percentage(order_created_count, view_count),
+            "order_to_payment": conversion_percentage(order_paid_count, order_created_count),
+            "payment_to_completion": conversion_percentage(order_completed_count, order_paid_count),
+            "overall_browse_to_purchase": conversion_percentage(order_paid_count, browse_count)
         }
     except Exception as e:
         logger.error(f"Error calculating conversion rates: {str(e)}")
@@ -132,71 +369,106 @@ async def get_metrics_report(
     
     # Add user acquisition metrics
     try:
-        users_registered = await Metric.filter(base_query & Q(metric_type=MetricType.USER_REGISTRATION)).count()
-        vendors_registered = await Metric.filter(base_query & Q(metric_type=MetricType.VENDOR_REGISTRATION)).count()
-        vendors_approved = await Metric.filter(base_query & Q(metric_type=MetricType.VENDOR_APPROVAL)).count()
-        
         report["summary"]["acquisition"] = {
-            "users_registered": users_registered,
-            "vendors_registered": vendors_registered,
-            "vendors_approved": vendors_approved,
+            "users_registered": type_counts.get(MetricType.USER_REGISTRATION.value, 0),
+            "vendors_registered": type_counts.get(MetricType.VENDOR_REGISTRATION.value, 0),
+            "vendors_approved": type_counts.get(MetricType.VENDOR_APPROVAL.value, 0),
         }
     except Exception as e:
         logger.error(f"Error calculating acquisition metrics: {str(e)}")
         report["summary"]["acquisition"] = "Error calculating acquisition metrics"
     
-    # Add engagement metrics
-    try:
-        # Meals per vendor
-        total_vendors = await Vendor.filter(status=VendorStatus.APPROVED).count()
-        total_meals = await Meal.filter(is_active=True).count()
-        meals_per_vendor = round(total_meals / total_vendors, 2) if total_vendors > 0 else 0
-        
-        # Average purchase value
-        orders = await Order.filter(status=OrderStatus.PAID).prefetch_related('meal')
-        if orders:
-            total_value = sum(order.quantity * order.meal.price for order in orders)
-            avg_order_value = round(float(total_value) / len(orders), 2) if orders else 0
-        else:
-            avg_order_value = 0
-        
-        report["summary"]["engagement"] = {
-            "meals_per_vendor": meals_per_vendor,
-            "avg_order_value": avg_order_value,
-            "total_sales_value": float(total_value) if 'total_value' in locals() else 0
-        }
-    except Exception as e:
-        logger.error(f"Error calculating engagement metrics: {str(e)}")
+    # Add all-time overview and engagement metrics
+    if isinstance(overview_engagement, Exception):
+        logger.error(f"Error calculating overview and engagement metrics: {str(overview_engagement)}")
+        report["summary"]["overview"] = "Error calculating overview metrics"
         report["summary"]["engagement"] = "Error calculating engagement metrics"
+    else:
+        report["summary"]["overview"], report["summary"]["engagement"] = overview_engagement
     
     # Add transaction metrics
-    try:
-        # Sales per day, calculated for each day in the range
-        days = (end_date - start_date).days + 1
-        daily_sales = []
-        
-        for day in range(days):
-            day_start = start_date + timedelta(days=day)
-            day_end = day_start + timedelta(days=1)
-            day_orders = await Metric.filter(
-                Q(timestamp__gte=day_start) & 
-                Q(timestamp__lt=day_end) & 
-                Q(metric_type=MetricType.ORDER_PAID)
-            ).count()
-            
-            daily_sales.append({
-                "date": day_start.date().isoformat(),
-                "orders": day_orders
-            })
-        
-        report["details"]["daily_sales"] = daily_sales
-    except Exception as e:
-        logger.error(f"Error calculating daily sales metrics: {str(e)}")
+    if isinstance(daily_sales, Exception):
+        logger.error(f"Error calculating daily sales metrics: {str(daily_sales)}")
         report["details"]["daily_sales"] = "Error calculating daily sales metrics"
+    else:
+        report["details"]["daily_sales"] = daily_sales
     
     return report
 
 
+async def _calc_overview_and_engagement(end_date: datetime) -> Tuple[Dict, Dict]:
+    """Calculate the all-time overview counts and the engagement metrics derived from them"""
+    (
+        total_vendors, approved_vendors, total_meals, listed_meals, active_meals,
+        order_totals, total_users
+    ) = await asyncio.gather(
+        Vendor.all().count(),
+        Vendor.filter(status=VendorStatus.APPROVED).count(),
+        Meal.all().count(),
+        Meal.filter(is_active=True).count(),
+        # Meals are "active" when still listed, in stock and not yet past their pickup window
+        Meal.filter(is_active=True, quantity__gt=0, pickup_end_time__gt=end_date).count(),
+        get_order_totals(),
+        Metric.filter(metric_type=MetricType.USER_REGISTRATION).count()
+    )
+    paid_orders, paid_value = order_totals.get(OrderStatus.PAID.value, (0, 0.0))
+    completed_orders, completed_value = order_totals.get(OrderStatus.COMPLETED.value, (0, 0.0))
+    
+    overview = {
+        "total_users": total_users,
+        "total_vendors": total_vendors,
+        "approved_vendors": approved_vendors,
+        "active_meals": active_meals,
+        "total_meals_ever": total_meals,
+        "paid_orders": paid_orders,
+        "completed_orders": completed_orders,
+        # GMV (Gross Merchandise Value)
+        "gmv_total": round(paid_value + completed_value, 2)
+    }
+    
+    # Meals per vendor
+    meals_per_vendor = round(listed_meals / approved_vendors, 2) if approved_vendors > 0 else 0
+    
+    # Average purchase value
+    avg_order_value = round(paid_value / paid_orders, 2) if paid_orders > 0 else 0
+    
+    engagement = {
+        "meals_per_vendor": meals_per_vendor,
+        "avg_order_value": avg_order_value,
+        "total_sales_value": paid_value
+    }
+    
+    return overview, engagement
+
+
+async def _calc_daily_sales(start_date: datetime, end_date: datetime) -> List[Dict]:
+    """Count paid orders per day, filling in days without sales"""
+    # Sales per Almaty calendar day, counted in one grouped query
+    rows = await Metric.filter(
+        metric_type=MetricType.ORDER_PAID,
+        timestamp__gte=start_date,
+        timestamp__lte=end_date
+    ).annotate(
+        day=_local_time_sql("day"),
+        orders=Count("id")
+    ).group_by("day").values("day", "orders")
+    # Postgres returns dates and SQLite ISO strings
+    orders_by_day = {date.fromisoformat(str(row["day"])): row["orders"] for row in rows}
+    
+    first_day = start_date.astimezone(ALMATY_TIMEZONE).date()
+    days = (end_date.astimezone(ALMATY_TIMEZONE).date() - first_day).days + 1
+    daily_sales = []
+    
+    for day in range(days):
+        day_date = first_day + timedelta(days=day)
+        daily_sales.append({
+            "date": day_date.isoformat(),
+            "orders": orders_by_day.get(day_date, 0)
+        })
+    
+    return daily_sales
+
+
 async def get_most_viewed_meals(limit: int = 10) -> List[Tuple[Meal, int]]:
     """
     Get the most viewed meals based on MEAL_VIEW metrics.
@@ -207,26 +479,24 @@ async def get_most_viewed_meals(limit: int = 10) -> List[Tuple[Meal, int]]:
     Returns:
         List of (Meal, view_count) tuples
     """
-    # Get meal IDs and their view counts
-    meal_views = {}
-    view_metrics = await Metric.filter(metric_type=MetricType.MEAL_VIEW).all()
-    
-    for metric in view_metrics:
-        if metric.entity_id:
-            meal_id = metric.entity_id
-            if meal_id not in meal_views:
-                meal_views[meal_id] = 0
-            meal_views[meal_id] += 1
+    # Count views per meal in the database and keep only the top ones
+    rows = await Metric.filter(
+        metric_type=MetricType.MEAL_VIEW,
+        entity_id__not_isnull=True
+    ).annotate(
+        views=Count("id")
+    ).group_by("entity_id").order_by("-views").limit(limit).values("entity_id", "views")
     
-    # Sort meal IDs by view count (descending)
-    sorted_meal_ids = sorted(meal_views.keys(), key=lambda x: meal_views[x], reverse=True)[:limit]
+    # Get the actual Meal objects in a single query
+    meal_ids = [row["entity_id"] for row in rows]
+    meals = {meal.id: meal for meal in await Meal.filter(id__in=meal_ids)}
     
-    # Get the actual Meal objects
+    # Keep the view count ordering, skipping meals that no longer exist
     result = []
-    for meal_id in sorted_meal_ids:
-        meal = await Meal.filter(id=meal_id).first()
+    for row in rows:
+        meal = meals.get(row["entity_id"])
         if meal:
-            result.append((meal, meal_views[meal_id]))
+            result.append((meal, row["views"]))
     
     return result
 
@@ -235,51 +505,40 @@ async def get_metrics_dashboard_data() -> Dict:
     """
     Get summarized metrics data for a dashboard display.
     
+    Results are cached for DASHBOARD_CACHE_TTL seconds, so repeated
+    requests within that window don't re-run the aggregation queries.
+    
     Returns:
         Dictionary with key metrics for dashboard display
     """
+    global _dashboard_cache
+    
+    # Serve a recent result from the cache if there is one
+    now = time.monotonic()
+    if _dashboard_cache and now - _dashboard_cache[0] < DASHBOARD_CACHE_TTL:
+        return _dashboard_cache[1]
+    
     try:
         # Get current time in Almaty timezone
         current_time = datetime.now(ALMATY_TIMEZONE)
+        week_ago = current_time - timedelta(days=7)
         
-        # Get counts
-        total_users = await Metric.filter(metric_type=MetricType.USER_REGISTRATION).count()
-        total_vendors = await Vendor.all().count()
-        approved_vendors = await Vendor.filter(status=VendorStatus.APPROVED).count()
-        total_meals = await Meal.all().count()
-        active_meals = await Meal.filter(is_active=True, quantity__gt=0, pickup_end_time__gt=current_time).count()
-        total_orders = await Order.all().count()
-        paid_orders = await Order.filter(status=OrderStatus.PAID).count()
-        completed_orders = await Order.filter(status=OrderStatus.COMPLETED).count()
-        
-        # Calculate GMV (Gross Merchandise Value)
-        gmv = 0
-        orders = await Order.filter(status__in=[OrderStatus.PAID, OrderStatus.COMPLETED]).prefetch_related('meal')
-        for order in orders:
-            gmv += float(order.meal.price) * order.quantity
-        
-        # Get 7-day metrics
-        week_ago = datetime.now(ALMATY_TIMEZONE) - timedelta(days=7)
-        week_metrics = await get_metrics_report(start_date=week_ago)
+        # The 7-day report also carries the all-time overview counts
+        week_metrics = await get_metrics_report(start_date=week_ago, end_date=current_time)
+        overview = week_metrics["summary"]["overview"]
+        if not isinstance(overview, dict):
+            raise ValueError(overview)
         
         # Prepare dashboard data
         dashboard = {
-            "overview": {
-                "total_users": total_users,
-                "total_vendors": total_vendors,
-                "approved_vendors": approved_vendors,
-                "active_meals": active_meals,
-                "total_meals_ever": total_meals,
-                "paid_orders": paid_orders,
-                "completed_orders": completed_orders,
-                "gmv_total": round(gmv, 2)
-            },
+            "overview": overview,
             "weekly": {
                 "conversion_rates": week_metrics["summary"].get("conversion", {}),
                 "daily_sales": week_metrics["details"].get("daily_sales", [])
             }
         }
         
+        _dashboard_cache = (now, dashboard)
         return dashboard
     except Exception as e:
         logger.error(f"Error generating metrics dashboard: {str(e)}")
@@ -290,27 +549,31 @@ async def get_peak_hours_analysis() -> Dict:
     """
     Analyze peak activity hours based on metric timestamps.
     
+    The last 30 days' metrics are counted per Almaty hour of day and day of
+    week in the database, so at most 24 and 7 rows are fetched.
+    
     Returns:
-        Dictionary with hourly activity breakdown
+        Dictionary with hourly and weekday activity breakdowns
     """
     try:
-        # Get all metrics from the last 30 days
         thirty_days_ago = datetime.now(ALMATY_TIMEZONE) - timedelta(days=30)
-        metrics = await Metric.filter(timestamp__gte=thirty_days_ago).all()
+        recent = Metric.filter(timestamp__gte=thirty_days_ago)
+        hour_rows, weekday_rows = await asyncio.gather(
+            recent.annotate(
+                hour=_local_time_sql("hour"),
+                count=Count("id")
+            ).group_by("hour").values_list("hour", "count"),
+            recent.annotate(
+                weekday=_local_time_sql("weekday"),
+                count=Count("id")
+            ).group_by("weekday").values_list("weekday", "count")
+        )
         
-        # Group by hour of day
+        # Fill in hours and weekdays without activity
         hourly_activity = {hour: 0 for hour in range(24)}
-        
-        for metric in metrics:
-            # Convert to Almaty timezone if needed
-            metric_time = metric.timestamp
-            if metric_time.tzinfo is None:
-                metric_time = metric_time.replace(tzinfo=ALMATY_TIMEZONE)
-            else:
-                metric_time = metric_time.astimezone(ALMATY_TIMEZONE)
-            
-            hour = metric_time.hour
-            hourly_activity[hour] += 1
+        hourly_activity.update(hour_rows)
+        weekday_activity = {weekday: 0 for weekday in range(7)}
+        weekday_activity.update(weekday_rows)
         
         # Find peak hours
         sorted_hours = sorted(hourly_activity.items(), key=lambda x: x[1], reverse=True)
@@ -318,6 +581,7 @@ async def get_peak_hours_analysis() -> Dict:
         
         return {
             "hourly_breakdown": hourly_activity,
+            "weekday_breakdown": weekday_activity,
             "peak_hours": peak_hours,
             "total_activity": sum(hourly_activity.values())
         }
@@ -335,35 +599,37 @@ async def get_user_activity_patterns() -> Dict:
     """
     try:
         # Get activity for the last 30 days
-        thirty_days_ago = datetime.now(ALMATY_TIMEZONE) - timedelta(days=30)
+        now = datetime.now(ALMATY_TIMEZONE)
+        thirty_days_ago = now - timedelta(days=30)
         
-        # Get all user activities
-        user_metrics = {}
-        metrics = await Metric.filter(
+        # Get per-user, per-type action counts in a single grouped query
+        rows = await Metric.filter(
             timestamp__gte=thirty_days_ago,
             user_id__isnull=False
-        ).all()
+        ).annotate(
+            count=Count("id"),
+            last_activity=Max("timestamp")
+        ).group_by("user_id", "metric_type").values("user_id", "metric_type", "count", "last_activity")
         
-        for metric in metrics:
-            user_id = metric.user_id
+        user_metrics = {}
+        for row in rows:
+            user_id = row["user_id"]
             if user_id not in user_metrics:
                 user_metrics[user_id] = {
                     "total_actions": 0,
                     "action_types": {},
-                    "last_activity": metric.timestamp
+                    "last_activity": row["last_activity"]
                 }
             
-            user_metrics[user_id]["total_actions"] += 1
+            user_metrics[user_id]["total_actions"] += row["count"]
             
             # Track action types
-            action_type = metric.metric_type.value
-            if action_type not in user_metrics[user_id]["action_types"]:
-                user_metrics[user_id]["action_types"][action_type] = 0
-            user_metrics[user_id]["action_types"][action_type] += 1
+            action_type = MetricType(row["metric_type"]).value
+            user_metrics[user_id]["action_types"][action_type] = row["count"]
             
             # Update last activity
-            if metric.timestamp > user_metrics[user_id]["last_activity"]:
-                user_metrics[user_id]["last_activity"] = metric.timestamp
+            if row["last_activity"] > user_metrics[user_id]["last_activity"]:
+                user_metrics[user_id]["last_activity"] = row["last_activity"]
         
         # Calculate engagement statistics
         if user_metrics:
@@ -377,7 +643,7 @@ async def get_user_activity_patterns() -> Dict:
             power_users = sorted_users[:power_user_count]
             
             # Calculate active users (users with activity in last 7 days)
-            week_ago = datetime.now(ALMATY_TIMEZONE) - timedelta(days=7)
+            week_ago = now - timedelta(days=7)
             active_users = sum(1 for data in user_metrics.values() 
                              if data["last_activity"] >= week_ago)
             
@@ -413,57 +679,38 @@ async def get_conversion_funnel_detailed() -> Dict:
     """
     try:
         # Get metrics for the last 30 days
-        thirty_days_ago = datetime.now(ALMATY_TIMEZONE) - timedelta(days=30)
+        now = datetime.now(ALMATY_TIMEZONE)
+        thirty_days_ago = now - timedelta(days=30)
         
-        # Count each step in the funnel
+        # Count each step in the funnel, using the daily rollups for whole days
+        funnel_types = [
+            ("browse", MetricType.MEAL_BROWSE),
+            ("view", MetricType.MEAL_VIEW),
+            ("order_created", MetricType.ORDER_CREATED),
+            ("order_paid", MetricType.ORDER_PAID),
+            ("order_completed", MetricType.ORDER_COMPLETED)
+        ]
+        type_counts = await count_metrics_in_range(
+            thirty_days_ago, now, [metric_type for _, metric_type in funnel_types]
+        )
         funnel_steps = {
-            "browse": await Metric.filter(
-                timestamp__gte=thirty_days_ago,
-                metric_type=MetricType.MEAL_BROWSE
-            ).count(),
-            "view": await Metric.filter(
-                timestamp__gte=thirty_days_ago,
-                metric_type=MetricType.MEAL_VIEW
-            ).count(),
-            "order_created": await Metric.filter(
-                timestamp__gte=thirty_days_ago,
-                metric_type=MetricType.ORDER_CREATED
-            ).count(),
-            "order_paid": await Metric.filter(
-                timestamp__gte=thirty_days_ago,
-                metric_type=MetricType.ORDER_PAID
-            ).count(),
-            "order_completed": await Metric.filter(
-                timestamp__gte=thirty_days_ago,
-                metric_type=MetricType.ORDER_COMPLETED
-            ).count()
+            step: type_counts.get(metric_type.value, 0)
+            for step, metric_type in funnel_types
         }
         
-        # Calculate conversion rates and dropoff
+        # Calculate conversion rates and dropoff between consecutive steps
         conversions = {}
         dropoffs = {}
         
-        steps = list(funnel_steps.keys())
-        for i in range(len(steps) - 1):
-            current_step = steps[i]
-            next_step = steps[i + 1]
-            
-            current_count = funnel_steps[current_step]
-            next_count = funnel_steps[next_step]
-            
-            if current_count > 0:
-                conversion_rate = round((next_count / current_count) * 100, 2)
-                dropoff_rate = round(100 - conversion_rate, 2)
-                dropoff_count = current_count - next_count
-            else:
-                conversion_rate = 0
-                dropoff_rate = 0
-                dropoff_count = 0
+        steps = list(funnel_steps.items())
+        for (current_step, current_count), (next_step, next_count) in zip(steps, steps[1:]):
+            conversion_rate = conversion_percentage(next_count, current_count)
+            has_entries = current_count > 0
             
             conversions[f"{current_step}_to_{next_step}"] = conversion_rate
             dropoffs[f"{current_step}_to_{next_step}"] = {
-                "rate": dropoff_rate,
-                "count": dropoff_count
+                "rate": round(100 - conversion_rate, 2) if has_entries else 0,
+                "count": current_count - next_count if has_entries else 0
             }
         
         return {
@@ -486,43 +733,58 @@ async def get_vendor_performance_metrics() -> Dict:
         Dictionary with vendor performance data
     """
     try:
-        # Get all approved vendors with their meals and orders
-        vendors = await Vendor.filter(status=VendorStatus.APPROVED).prefetch_related('meals', 'meals__orders').all()
+        paid_statuses = {OrderStatus.PAID.value, OrderStatus.COMPLETED.value}
+        
+        # Aggregate meals and orders per approved vendor in the database
+        vendors, meal_rows, order_rows = await asyncio.gather(
+            Vendor.filter(status=VendorStatus.APPROVED).values("id", "telegram_id", "name"),
+            # Active meal count and average price
+            Meal.filter(vendor__status=VendorStatus.APPROVED, is_active=True).annotate(
+                active_meals=Count("id"),
+                avg_meal_price=Avg("price")
+            ).group_by("vendor_id").values("vendor_id", "active_meals", "avg_meal_price"),
+            # Orders and portions per status and meal price, for the revenue
+            Order.filter(meal__vendor__status=VendorStatus.APPROVED).annotate(
+                count=Count("id"),
+                portions=Sum("quantity")
+            ).group_by("meal__vendor_id", "status", "meal__price").values(
+                "meal__vendor_id", "status", "meal__price", "count", "portions"
+            )
+        )
+        
+        meal_stats = {row["vendor_id"]: row for row in meal_rows}
+        
+        # [total orders, paid orders, revenue] per vendor
+        order_stats = {}
+        for row in order_rows:
+            stats = order_stats.setdefault(row["meal__vendor_id"], [0, 0, 0.0])
+            stats[0] += row["count"]
+            if OrderStatus(row["status"]).value in paid_statuses:
+                stats[1] += row["count"]
+                stats[2] += float(row["portions"] * row["meal__price"])
         
         vendor_stats = []
         
         for vendor in vendors:
-            # Calculate metrics for each vendor
-            total_meals = len([meal for meal in vendor.meals if meal.is_active])
-            total_orders = sum(len(meal.orders) for meal in vendor.meals)
-            paid_orders = sum(len([order for order in meal.orders if order.status in [OrderStatus.PAID, OrderStatus.COMPLETED]]) for meal in vendor.meals)
-            
-            # Calculate revenue
-            total_revenue = 0
-            for meal in vendor.meals:
-                for order in meal.orders:
-                    if order.status in [OrderStatus.PAID, OrderStatus.COMPLETED]:
-                        total_revenue += float(meal.price) * order.quantity
-            
-            # Calculate average meal price
-            active_meals = [meal for meal in vendor.meals if meal.is_active]
-            avg_meal_price = sum(float(meal.price) for meal in active_meals) / len(active_meals) if active_meals else 0
+            meals = meal_stats.get(vendor["id"], {})
+            total_meals = meals.get("active_meals", 0)
+            total_orders, paid_orders, total_revenue = order_stats.get(vendor["id"], (0, 0, 0.0))
             
             vendor_stats.append({
-                "vendor_id": vendor.telegram_id,
-                "vendor_name": vendor.name,
+                "vendor_id": vendor["telegram_id"],
+                "vendor_name": vendor["name"],
                 "total_meals": total_meals,
                 "total_orders": total_orders,
                 "paid_orders": paid_orders,
                 "total_revenue": round(total_revenue, 2),
-                "avg_meal_price": round(avg_meal_price, 2),
+                "avg_meal_price": round(float(meals.get("avg_meal_price") or 0), 2),
                 "orders_per_meal": round(paid_orders / total_meals, 2) if total_meals > 0 else 0
             })
         
         # Sort by revenue
         vendor_stats.sort(key=lambda x: x["total_revenue"], reverse=True)
         
-        # Calculate aggregate statistics
+        # Calculate aggregate statistics across all approved vendors
         total_vendors = len(vendor_stats)
         total_revenue_all = sum(v["total_revenue"] for v in vendor_stats)
         avg_revenue_per_vendor = total_revenue_all / total_vendors if total_vendors > 0 else 0
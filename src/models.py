@@ -93,6 +93,9 @@ class Meal(Model):
 
     class Meta:
         table = "meals"
+        indexes = [
+            ("is_active", "quantity", "pickup_end_time"),
+        ]
 
 
 class Order(Model):
@@ -110,6 +113,9 @@ class Order(Model):
 
     class Meta:
         table = "orders"
+        indexes = [
+            ("status",),
+        ]
 
 
 class Commission(Model):
@@ -192,3 +198,21 @@ class Metric(Model):
     
     class Meta:
         table = "metrics"
+        indexes = [
+            ("metric_type", "timestamp"),
+            ("user_id", "timestamp"),
+            ("entity_id", "metric_type"),
+            ("timestamp",),
+        ]
+
+
+class MetricDailyRollup(Model):
+    """Daily metric counts per type, refreshed periodically from the metrics table."""
+    id = fields.IntField(pk=True)
+    date = fields.DateField()  # Calendar day in Almaty time
+    metric_type = fields.CharEnumField(MetricType)
+    count = fields.IntField(default=0)
+    
+    class Meta:
+        table = "metric_daily_rollups"
+        unique_together = ("date", "metric_type")
@@ -1,6 +1,6 @@
 import logging
 import asyncio
-import uuid
+import secrets
 import hmac
 import hashlib
 from .config import (
@@ -15,10 +15,33 @@ from .config import (
     TELEGRAM_PAYMENT_PROVIDER_TOKEN,
     TELEGRAM_PAYMENT_CURRENCY
 )
+from tortoise.expressions import F
+from tortoise.transactions import in_transaction
 from .models import Order, OrderStatus, Meal
 
 logger = logging.getLogger(__name__)
 
+
+async def decrement_meal_quantity(meal_id, quantity, connection=None):
+    """
+    Atomically reduce a meal's remaining quantity, never going below zero.
+    
+    The decrement runs as a conditional UPDATE in the database, so concurrent
+    payments for the same meal can't overwrite each other's changes.
+    
+    Args:
+        meal_id: ID of the meal to update
+        quantity: Number of portions to take from stock
+        connection: Optional transaction connection to run the update in
+    """
+    updated = await Meal.filter(id=meal_id, quantity__gte=quantity).using_db(connection).update(
+        quantity=F("quantity") - quantity
+    )
+    if not updated:
+        # Not enough stock left for the full amount, so the meal is sold out
+        await Meal.filter(id=meal_id).using_db(connection).update(quantity=0)
+
+
 class PaymentGateway:
     """
     Payment gateway integration for As Bolsyn.
@@ -34,6 +57,22 @@ class PaymentGateway:
         self.secret = PAYMENT_GATEWAY_SECRET
         self.base_url = PAYMENT_GATEWAY_URL
         
+        # Keyed HMAC state for webhook signatures, copied for each verification
+        # so the secret is only processed once
+        self.webhook_hmac = (
+            hmac.new(PAYMENT_WEBHOOK_SECRET.encode(), digestmod=hashlib.sha256)
+            if PAYMENT_WEBHOOK_SECRET else None
+        )
+        
+        # Signature checks are decided once: with the gateway disabled or no
+        # secret configured (testing mode), every webhook is accepted
+        if not self.enabled or self.webhook_hmac is None:
+            self.verify_webhook_signature = self._accept_any_signature
+        
+        # Redirect targets, with fallbacks for when environment variables aren't set
+        self.success_url = PAYMENT_SUCCESS_URL or "https://t.me/as_bolsyn_bot"
+        self.failure_url = PAYMENT_FAILURE_URL or "https://t.me/as_bolsyn_bot"
+        
         # Telegram payment settings
         self.telegram_payment_enabled = TELEGRAM_PAYMENT_ENABLED
         self.telegram_provider_token = TELEGRAM_PAYMENT_PROVIDER_TOKEN
@@ -67,7 +106,7 @@ class PaymentGateway:
         if self.is_telegram_payments_available():
             # For Telegram payments, we only need to return a payment ID
             # The actual payment will be initiated via the Telegram API with an invoice
-            payment_id = f"TG-{order_id}-{int(uuid.uuid4())}"
+            payment_id = f"TG-{order_id}-{secrets.token_hex(8)}"
             logger.info(f"Creating Telegram payment {payment_id} for order {order_id} with amount {amount}")
             return payment_id, None
             
@@ -77,20 +116,18 @@ class PaymentGateway:
             return None, None
             
         # Generate a unique payment ID
-        payment_id = f"EXT-{order_id}-{int(uuid.uuid4())}"
+        payment_id = f"EXT-{order_id}-{secrets.token_hex(8)}"
         
         # In a real implementation, this would make an API call to the payment gateway
         # For the MVP, we'll simulate the payment flow
         logger.info(f"Creating external payment {payment_id} for order {order_id} with amount {amount}")
         
-        # Ensure we have valid URLs even when environment variables aren't set
+        # Ensure we have a valid URL even when the environment variable isn't set
         base_url = self.base_url or "https://example.com"
-        success_url = PAYMENT_SUCCESS_URL or "https://t.me/as_bolsyn_bot"
-        failure_url = PAYMENT_FAILURE_URL or "https://t.me/as_bolsyn_bot"
         
         # Generate a simulated payment URL
-        success_redirect = f"{success_url}?order_id={order_id}&payment_id={payment_id}"
-        failure_redirect = f"{failure_url}?order_id={order_id}&payment_id={payment_id}"
+        success_redirect = f"{self.success_url}?order_id={order_id}&payment_id={payment_id}"
+        failure_redirect = f"{self.failure_url}?order_id={order_id}&payment_id={payment_id}"
         
         # Create a simulated payment URL with proper HTTP format
         payment_url = f"{base_url}/pay?order_id={order_id}&amount={amount}&payment_id={payment_id}&success_url={success_redirect}&failure_url={failure_redirect}"
@@ -103,23 +140,30 @@ class PaymentGateway:
         Verify that the webhook payload signature matches the expected value.
         
         Args:
-            payload: The webhook payload as a string
+            payload: The webhook payload as a string or bytes
             signature: The signature to verify
             
         Returns:
             bool: True if the signature is valid, False otherwise
         """
-        if not self.enabled or not PAYMENT_WEBHOOK_SECRET:
-            # In testing mode, always return true
-            return True
-            
-        expected_signature = hmac.new(
-            PAYMENT_WEBHOOK_SECRET.encode(),
-            payload.encode(),
-            hashlib.sha256
-        ).hexdigest()
+        if isinstance(payload, str):
+            payload = payload.encode()
+        
+        # Compare raw digest bytes rather than their hex encoding
+        try:
+            provided_signature = bytes.fromhex(signature)
+        except (TypeError, ValueError):
+            logger.warning("Webhook signature is not a valid hex string")
+            return False
         
-        return hmac.compare_digest(signature, expected_signature)
+        mac = self.webhook_hmac.copy()
+        mac.update(payload)
+        
+        return hmac.compare_digest(provided_signature, mac.digest())
+    
+    def _accept_any_signature(self, payload, signature):
+        """Signature check used when webhook verification is disabled"""
+        return True
     
     async def process_webhook(self, data):
         """
@@ -150,18 +194,27 @@ class PaymentGateway:
             except Exception as e:
                 logger.error(f"Error retrieving order {order_id}: {e}")
                 return False
+            
+            # Gateways may redeliver webhooks; only a pending order can still be paid,
+            # so skip orders a previous webhook or the order lifecycle already settled
+            if order.status != OrderStatus.PENDING:
+                logger.info(f"Order {order_id} already {order.status.value}, skipping payment {payment_id}")
+                return True
                 
-            # Update order status
-            order.status = OrderStatus.PAID
-            order.payment_id = payment_id
-            await order.save()
+            # Mark the order paid and take the portions from stock together,
+            # so a failure can't leave a paid order with untouched stock. Only
+            # a pending order is updated, so concurrent or late redeliveries
+            # can't re-pay an order or take its portions twice.
+            async with in_transaction() as connection:
+                updated = await Order.filter(
+                    id=order.id, status=OrderStatus.PENDING
+                ).using_db(connection).update(status=OrderStatus.PAID, payment_id=payment_id)
+                if updated == 1:
+                    await decrement_meal_quantity(order.meal_id, order.quantity, connection)
             
-            # Update meal quantity
-            meal = await order.meal
-            meal.quantity -= order.quantity
-            if meal.quantity < 0:
-                meal.quantity = 0
-            await meal.save()
+            if updated != 1:
+                logger.info(f"Order {order_id} is no longer pending, payment {payment_id} not applied")
+                return True
             
             logger.info(f"Order {order_id} marked as paid with payment {payment_id}")
             return True
@@ -1,7 +1,8 @@
 import time
 import logging
 import asyncio
-from collections import defaultdict
+from collections import Counter, defaultdict, deque
+from aiohttp import web
 from aiogram import types
 from aiogram.types import Message
 import re
@@ -14,16 +15,18 @@ logger = logging.getLogger(__name__)
 # Rate limiting configuration
 class RateLimiter:
     def __init__(self):
-        # Store request timestamps for each user
-        self.user_requests = defaultdict(list)
-        # Store command usage counts
-        self.command_usage = defaultdict(lambda: defaultdict(int))
+        # Store request timestamps for each user, oldest first
+        self.user_requests = defaultdict(deque)
+        # Store command usage counts, reset daily per user
+        self.command_usage = defaultdict(Counter)
+        self.command_reset = {}
         # Track potential spam/attack patterns
         self.suspicious_activity = defaultdict(int)
-        # Banned users (temporarily or permanently)
-        self.banned_users = set()
-        # IP address tracking (for webhook mode)
-        self.ip_requests = defaultdict(list)
+        # Banned users (temporarily or permanently); read on every request and
+        # rarely changed, so bans swap in a new frozenset instead of mutating it
+        self.banned_users = frozenset()
+        # IP address tracking (for webhook mode), oldest first
+        self.ip_requests = defaultdict(deque)
         # Configure cleanup task
         self.cleanup_interval = 3600  # 1 hour
         
@@ -36,27 +39,21 @@ class RateLimiter:
     def _cleanup_old_data(self):
         """Remove old request data to prevent memory buildup"""
         current_time = time.time()
-        # Keep only last hour of data
-        for user_id in list(self.user_requests.keys()):
-            self.user_requests[user_id] = [
-                timestamp for timestamp in self.user_requests[user_id]
-                if current_time - timestamp < 3600
-            ]
-            if not self.user_requests[user_id]:
+        # Windows are trimmed on every request, so only idle entries need removing:
+        # drop users with no request in the last hour, checking just the newest one
+        for user_id, requests in list(self.user_requests.items()):
+            if not requests or current_time - requests[-1] >= 3600:
                 del self.user_requests[user_id]
                 
         # Reset command usage counts that are old
         for user_id in list(self.command_usage.keys()):
-            if current_time - self.command_usage[user_id].get('last_reset', 0) > 86400:  # 24 hours
+            if current_time - self.command_reset.get(user_id, 0) > 86400:  # 24 hours
                 del self.command_usage[user_id]
+                self.command_reset.pop(user_id, None)
                 
-        # Reset IP tracking data
-        for ip in list(self.ip_requests.keys()):
-            self.ip_requests[ip] = [
-                timestamp for timestamp in self.ip_requests[ip]
-                if current_time - timestamp < 3600
-            ]
-            if not self.ip_requests[ip]:
+        # Reset IP tracking data for idle addresses
+        for ip, requests in list(self.ip_requests.items()):
+            if not requests or current_time - requests[-1] >= 3600:
                 del self.ip_requests[ip]
                 
         # Unban temporary banned users
@@ -84,13 +81,13 @@ class RateLimiter:
         current_time = time.time()
         
         # Add the current request timestamp
-        self.user_requests[user_id].append(current_time)
+        requests = self.user_requests[user_id]
+        requests.append(current_time)
         
-        # Count recent requests within the period
-        recent_requests = sum(
-            1 for timestamp in self.user_requests[user_id]
-            if current_time - timestamp < period
-        )
+        # Drop requests that have left the period, the rest are the recent ones
+        while current_time - requests[0] >= period:
+            requests.popleft()
+        recent_requests = len(requests)
         
         # Apply rate limiting if too many requests
         if recent_requests > limit:
@@ -100,7 +97,7 @@ class RateLimiter:
             # Ban user temporarily if consistently abusing
             if self.suspicious_activity[user_id] > 5:
                 logger.warning(f"User {user_id} temporarily banned for excessive requests")
-                self.banned_users.add(user_id)
+                self.banned_users = self.banned_users | {user_id}
                 
             logger.warning(f"Rate limit exceeded for user {user_id}: {recent_requests} requests in {period}s")
             return True
@@ -117,18 +114,19 @@ class RateLimiter:
         """
         current_time = time.time()
         
-        # Update last reset time if needed
-        if 'last_reset' not in self.command_usage[user_id] or \
-           current_time - self.command_usage[user_id]['last_reset'] > 86400:  # 24 hours
-            self.command_usage[user_id] = {'last_reset': current_time}
+        # Reset the counts once a day
+        if current_time - self.command_reset.get(user_id, 0) > 86400:  # 24 hours
+            self.command_usage[user_id].clear()
+            self.command_reset[user_id] = current_time
             
         # Increment command count
-        self.command_usage[user_id][command] = self.command_usage[user_id].get(command, 0) + 1
+        usage = self.command_usage[user_id]
+        usage[command] += 1
         
         # Check for suspicious patterns
-        if self.command_usage[user_id][command] > 50:  # Unusually high command usage
+        if usage[command] > 50:  # Unusually high command usage
             self.suspicious_activity[user_id] += 1
-            logger.warning(f"Suspicious command usage pattern for user {user_id}: {command} used {self.command_usage[user_id][command]} times")
+            logger.warning(f"Suspicious command usage pattern for user {user_id}: {command} used {usage[command]} times")
             
     def track_ip(self, ip_address):
         """
@@ -143,13 +141,13 @@ class RateLimiter:
         current_time = time.time()
         
         # Add the current request timestamp
-        self.ip_requests[ip_address].append(current_time)
+        requests = self.ip_requests[ip_address]
+        requests.append(current_time)
         
-        # Count recent requests within a short period (10 seconds)
-        recent_requests = sum(
-            1 for timestamp in self.ip_requests[ip_address]
-            if current_time - timestamp < 10
-        )
+        # Keep only requests within a short period (10 seconds)
+        while current_time - requests[0] >= 10:
+            requests.popleft()
+        recent_requests = len(requests)
         
         # Apply IP blocking if too many requests in a short time
         if recent_requests > 30:  # More than 30 requests in 10 seconds
@@ -161,7 +159,10 @@ class RateLimiter:
 # Create a global rate limiter instance
 rate_limiter = RateLimiter()
 
-# Spam detection
+# Spam detection patterns, compiled once
+URL_PATTERN = re.compile(r'https?://\S+')
+REPETITION_PATTERN = re.compile(r'(.+?)\1{4,}')
+
 def contains_spam(text):
     """
     Check if message contains potential spam patterns
@@ -175,19 +176,17 @@ def contains_spam(text):
     if not text:
         return False
         
-    # Check for excessive URLs
-    url_pattern = re.compile(r'https?://\S+')
-    urls = url_pattern.findall(text)
-    if len(urls) > 3:
-        return True
-        
-    # Check for message length (spam is often very long)
+    # Check for message length first, it's the cheapest test (spam is often very long)
     if len(text) > 1000:
         return True
         
+    # Check for excessive URLs, stopping as soon as there are more than 3
+    for url_count, _ in enumerate(URL_PATTERN.finditer(text), 1):
+        if url_count > 3:
+            return True
+        
     # Check for repetitive patterns
-    repetition_pattern = re.compile(r'(.+?)\1{4,}')
-    if repetition_pattern.search(text):
+    if REPETITION_PATTERN.search(text):
         return True
         
     return False
@@ -216,13 +215,16 @@ def rate_limit(limit=5, period=60, key=None):
             
             # Handle commands and spam only for Message objects, not CallbackQuery
             if hasattr(message, 'content_type') and hasattr(message, 'text'):
+                # Only text messages are checked, so read the text once
+                text = message.text if message.content_type == types.ContentType.TEXT else None
+                
                 # Track command usage if it's a command
-                if message.content_type == types.ContentType.TEXT and message.text and message.text.startswith("/"):
-                    command = message.text.split()[0]
+                if text and text.startswith("/"):
+                    command = text.split(maxsplit=1)[0]
                     rate_limiter.track_command(user_id, command)
                 
                 # Check for spam in text messages
-                if message.content_type == types.ContentType.TEXT and contains_spam(message.text):
+                if text and contains_spam(text):
                     logger.warning(f"Spam message detected from user {user_id}")
                     await message.answer("Ваше сообщение было заблокировано как возможный спам.")
                     return
@@ -255,15 +257,16 @@ async def webhook_security_middleware(request, handler):
     # Get client IP
     ip = request.remote
     
+    # Check for suspicious headers or payload size first, from the declared
+    # length only, so oversized requests are rejected before any tracking
+    if request.content_length and request.content_length > 1024 * 1024:  # > 1MB
+        logger.warning(f"Oversized webhook payload from IP: {ip}")
+        return web.Response(status=413, text="Payload too large")
+    
     # Check if this IP is sending too many requests
     if rate_limiter.track_ip(ip):
         logger.warning(f"Blocked potential DDOS attack from IP: {ip}")
-        return
-    
-    # Check for suspicious headers or payload size
-    if request.content_length and request.content_length > 1024 * 1024:  # > 1MB
-        logger.warning(f"Oversized webhook payload from IP: {ip}")
-        return
+        return web.Response(status=429, text="Too many requests")
     
     # If no security issues, proceed with the handler
     return await handler(request)
@@ -2,21 +2,38 @@ import asyncio
 import logging
 import os
 import sys
-from tortoise import Tortoise
-from .config import DB_URL
+import asyncpg
+from .config import DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME, TESTING
 
 logger = logging.getLogger(__name__)
 
-async def wait_for_database(max_attempts=30, delay=2):
+async def check_database_connection():
+    """Open a single connection, run a trivial query and close it again"""
+    if TESTING:
+        # The in-memory SQLite test database is always available
+        return
+    
+    conn = await asyncpg.connect(
+        host=DB_HOST,
+        port=DB_PORT,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        database=DB_NAME,
+        timeout=30
+    )
+    try:
+        await conn.fetchval("SELECT 1")
+    finally:
+        await conn.close()
+
+async def wait_for_database(max_attempts=30, delay=2, max_delay=10):
     """Wait for database to be ready with connection testing"""
     for attempt in range(max_attempts):
         try:
             logger.info(f"Testing database connection (attempt {attempt + 1}/{max_attempts})")
             
-            # Create a simple test connection
-            from .config import TORTOISE_ORM
-            await Tortoise.init(config=TORTOISE_ORM)
-            await Tortoise.close_connections()
+            # Probe with a plain connection; the ORM is initialised by the application itself
+            await check_database_connection()
             
             logger.info("Database connection successful!")
             return True
@@ -24,8 +41,10 @@ async def wait_for_database(max_attempts=30, delay=2):
         except Exception as e:
             logger.warning(f"Database connection attempt {attempt + 1} failed: {e}")
             if attempt < max_attempts - 1:
-                logger.info(f"Retrying in {delay} seconds...")
+                logger.info(f"Retrying in {delay:.1f} seconds...")
                 await asyncio.sleep(delay)
+                # Back off gradually while the database is still starting up
+                delay = min(delay * 1.5, max_delay)
             else:
                 logger.error("All database connection attempts failed")
                 return False
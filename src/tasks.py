@@ -2,47 +2,43 @@ import asyncio
 import logging
 import datetime
 
-from .models import Meal, Order, OrderStatus
-from .config import ALMATY_TIMEZONE
+from tortoise import Tortoise
+
+from .models import Meal, Order, OrderStatus, Metric
+from .metrics import get_latest_rollup_day
+from .config import ALMATY_TIMEZONE, ALMATY_TIMEZONE_NAME
 
 logger = logging.getLogger(__name__)
 
+# Recount metrics per Almaty calendar day and type since a given moment
+REFRESH_METRIC_ROLLUPS_SQL = """
+    INSERT INTO "metric_daily_rollups" ("date", "metric_type", "count")
+    SELECT DATE("timestamp" AT TIME ZONE $1), "metric_type", COUNT(*)
+    FROM "metrics"
+    WHERE "timestamp" >= $2
+    GROUP BY 1, 2
+    ON CONFLICT ("date", "metric_type") DO UPDATE SET "count" = EXCLUDED."count"
+"""
+
 async def deactivate_expired_meals():
     """
     Deactivate meals where the pickup window has ended.
     This task should run periodically to check and update meal statuses.
     """
     try:
-        # Get current time in Almaty timezone
-        now = datetime.datetime.now(ALMATY_TIMEZONE)
+        # Get current time in UTC (stored timestamps are timezone-aware)
+        now = datetime.datetime.now(datetime.timezone.utc)
         
-        # Get all active meals and check them individually for proper timezone handling
-        active_meals = await Meal.filter(is_active=True)
+        # Deactivate active meals whose pickup window has ended in a single
+        # UPDATE; the conditions are checked as the rows are written, so a meal
+        # whose window was extended in the meantime stays active. The database
+        # compares the timezone-aware timestamps, so no per-meal conversion is needed.
+        count = await Meal.filter(
+            is_active=True,
+            pickup_end_time__lte=now
+        ).update(is_active=False)
         
-        expired_meals = []
-        for meal in active_meals:
-            # Ensure pickup_end_time is timezone-aware and convert to Almaty timezone
-            if meal.pickup_end_time.tzinfo is None:
-                # If naive datetime, assume it's in Almaty timezone
-                pickup_end_time = meal.pickup_end_time.replace(tzinfo=ALMATY_TIMEZONE)
-            else:
-                # Convert to Almaty timezone
-                pickup_end_time = meal.pickup_end_time.astimezone(ALMATY_TIMEZONE)
-            
-            # Check if meal has expired
-            if pickup_end_time <= now:
-                expired_meals.append(meal)
-        
-        if expired_meals:
-            count = len(expired_meals)
-            logger.info(f"Found {count} expired meals to deactivate")
-            
-            # Deactivate each expired meal
-            for meal in expired_meals:
-                meal.is_active = False
-                await meal.save()
-                logger.info(f"Deactivated meal: {meal.id} - {meal.name}")
-            
+        if count:
             logger.info(f"Successfully deactivated {count} expired meals")
         else:
             logger.info("No expired meals found to deactivate")
@@ -57,29 +53,28 @@ async def cleanup_expired_orders():
     This prevents accumulation of unpaid orders and frees up meal quantities.
     """
     try:
-        # Get current time in Almaty timezone
-        now = datetime.datetime.now(ALMATY_TIMEZONE)
+        # Get current time in UTC (stored timestamps are timezone-aware)
+        now = datetime.datetime.now(datetime.timezone.utc)
         
         # Calculate the cutoff time (30 minutes ago)
         cutoff_time = now - datetime.timedelta(minutes=30)
         
         # Find all PENDING orders older than 30 minutes
-        expired_orders = await Order.filter(
+        expired_order_ids = await Order.filter(
             status=OrderStatus.PENDING,
             created_at__lt=cutoff_time
-        ).prefetch_related('meal')
+        ).values_list("id", flat=True)
         
-        if expired_orders:
-            count = len(expired_orders)
+        if expired_order_ids:
+            count = len(expired_order_ids)
             logger.info(f"Found {count} expired pending orders to cancel")
             
-            # Cancel each expired order
-            for order in expired_orders:
-                order.status = OrderStatus.CANCELLED
-                await order.save()
-                
-                # Log the cancellation
-                logger.info(f"Auto-cancelled expired order: {order.id} (meal: {order.meal.name})")
+            # Cancel all expired orders in a single UPDATE, skipping any paid in the meantime
+            await Order.filter(
+                id__in=expired_order_ids,
+                status=OrderStatus.PENDING
+            ).update(status=OrderStatus.CANCELLED)
+            logger.info(f"Auto-cancelled expired orders: {expired_order_ids}")
             
             logger.info(f"Successfully cancelled {count} expired pending orders")
         else:
@@ -88,8 +83,54 @@ async def cleanup_expired_orders():
     except Exception as e:
         logger.error(f"Error in cleanup_expired_orders task: {e}")
 
+
+async def get_rollup_refresh_start():
+    """
+    Get the moment the next metric rollup refresh has to recount from.
+    
+    The refresh starts at the day before the newest rolled-up day, so events
+    logged just before midnight are included. That day only moves forward
+    when a refresh succeeds, so days missed while the process was down or a
+    refresh failed are recounted on the next run. With no rollups yet, every
+    metric is counted.
+    
+    Returns:
+        Start of an Almaty calendar day, or None if there are no metrics
+    """
+    latest_day = await get_latest_rollup_day()
+    if latest_day is not None:
+        first_day = latest_day - datetime.timedelta(days=1)
+    else:
+        first_metric = await Metric.all().order_by("timestamp").first().values_list("timestamp", flat=True)
+        if first_metric is None:
+            return None
+        first_day = first_metric.astimezone(ALMATY_TIMEZONE).date()
+    
+    return ALMATY_TIMEZONE.localize(datetime.datetime.combine(first_day, datetime.time.min))
+
+
+async def refresh_metric_rollups():
+    """
+    Refresh the daily metric rollups from the newest rolled-up day onwards.
+    See get_rollup_refresh_start for which days are recounted.
+    """
+    try:
+        since = await get_rollup_refresh_start()
+        if since is None:
+            logger.info("No metrics to roll up")
+            return
+        
+        connection = Tortoise.get_connection("default")
+        await connection.execute_query(REFRESH_METRIC_ROLLUPS_SQL, [ALMATY_TIMEZONE_NAME, since])
+        
+        logger.info(f"Refreshed metric rollups since {since.date().isoformat()}")
+        
+    except Exception as e:
+        logger.error(f"Error in refresh_metric_rollups task: {e}")
+
 # Dictionary of scheduled tasks for easy access
 scheduled_tasks = {
     "deactivate_expired_meals": deactivate_expired_meals,
-    "cleanup_expired_orders": cleanup_expired_orders
+    "cleanup_expired_orders": cleanup_expired_orders,
+    "refresh_metric_rollups": refresh_metric_rollups
 } 
\ No newline at end of file
@@ -5,7 +5,9 @@ This script sends a test payment webhook to verify the webhook integration.
 """
 
 import argparse
+import asyncio
 import json
+import aiohttp
 import requests
 import logging
 import sys
@@ -14,6 +16,14 @@ import sys
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+def build_webhook_payload(order_id, payment_id="test_payment_123", status="completed"):
+    """Prepare the JSON payload for a test payment webhook"""
+    return {
+        "payment_id": payment_id,
+        "status": status,
+        "order_id": str(order_id)
+    }
+
 def send_test_webhook(webhook_url, order_id, payment_id="test_payment_123", status="completed"):
     """
     Send a test payment webhook to the specified URL.
@@ -27,12 +37,7 @@ def send_test_webhook(webhook_url, order_id, payment_id="test_payment_123", stat
     Returns:
         bool: True if the webhook was successfully processed, False otherwise
     """
-    # Prepare webhook payload
-    payload = {
-        "payment_id": payment_id,
-        "status": status,
-        "order_id": str(order_id)
-    }
+    payload = build_webhook_payload(order_id, payment_id, status)
     
     logger.info(f"Sending payment webhook to {webhook_url}")
     logger.info(f"Payload: {json.dumps(payload, indent=2)}")
@@ -59,6 +64,61 @@ def send_test_webhook(webhook_url, order_id, payment_id="test_payment_123", stat
         logger.error(f"Error sending webhook: {e}")
         return False
 
+async def send_test_webhook_async(session, webhook_url, order_id, payment_id="test_payment_123", status="completed"):
+    """
+    Send a test payment webhook using a shared aiohttp session.
+    
+    Args:
+        session: The aiohttp.ClientSession to send the request with
+        webhook_url: The URL to send the webhook to
+        order_id: The ID of the order to update
+        payment_id: The payment ID (default: test_payment_123)
+        status: The payment status (default: completed)
+        
+    Returns:
+        bool: True if the webhook was successfully processed, False otherwise
+    """
+    payload = build_webhook_payload(order_id, payment_id, status)
+    
+    try:
+        async with session.post(webhook_url, json=payload, timeout=aiohttp.ClientTimeout(total=10)) as response:
+            text = await response.text()
+            if response.status == 200:
+                return True
+            logger.error(f"Failed to send webhook. Status code: {response.status}, response: {text}")
+            return False
+            
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.error(f"Error sending webhook: {e}")
+        return False
+
+async def send_test_webhooks_concurrently(webhook_url, order_id, payment_id, status, concurrency):
+    """
+    Send the same test webhook several times at once, e.g. for load testing.
+    
+    Args:
+        webhook_url: The URL to send the webhooks to
+        order_id: The ID of the order to update
+        payment_id: The payment ID
+        status: The payment status
+        concurrency: Number of webhooks to send
+        
+    Returns:
+        bool: True if every webhook was successfully processed, False otherwise
+    """
+    logger.info(f"Sending {concurrency} payment webhooks to {webhook_url}")
+    
+    # One session so all requests share its connection pool
+    async with aiohttp.ClientSession() as session:
+        results = await asyncio.gather(*[
+            send_test_webhook_async(session, webhook_url, order_id, payment_id, status)
+            for _ in range(concurrency)
+        ])
+    
+    succeeded = sum(results)
+    logger.info(f"{succeeded}/{concurrency} webhooks successfully sent")
+    return succeeded == concurrency
+
 def main():
     """Main function to parse arguments and send webhook"""
     parser = argparse.ArgumentParser(description="Test payment webhook for As Bolsyn")
@@ -68,16 +128,27 @@ def main():
     parser.add_argument("--payment-id", default="test_payment_123", help="Payment ID (default: test_payment_123)")
     parser.add_argument("--status", default="completed", choices=["completed", "pending", "failed"], 
                         help="Payment status (default: completed)")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="Number of webhooks to send concurrently (default: 1)")
     
     args = parser.parse_args()
     
     # Send the webhook
-    success = send_test_webhook(
-        webhook_url=args.url,
-        order_id=args.order_id,
-        payment_id=args.payment_id,
-        status=args.status
-    )
+    if args.concurrency > 1:
+        success = asyncio.run(send_test_webhooks_concurrently(
+            webhook_url=args.url,
+            order_id=args.order_id,
+            payment_id=args.payment_id,
+            status=args.status,
+            concurrency=args.concurrency
+        ))
+    else:
+        success = send_test_webhook(
+            webhook_url=args.url,
+            order_id=args.order_id,
+            payment_id=args.payment_id,
+            status=args.status
+        )
     
     # Exit with appropriate status code
     sys.exit(0 if success else 1)
@@ -1,14 +1,57 @@
+import asyncio
 import pytest
-import pytest_asyncio
 import os
+import sys
+import importlib
+from types import SimpleNamespace
+from unittest.mock import MagicMock, AsyncMock, patch
+
+# Mock modules that might not be installed. This runs once per session, and
+# only modules that fail to import are replaced so real packages are kept.
+OPTIONAL_MODULES = [
+    'tortoise', 'tortoise.models', 'tortoise.fields',
+    'aiogram', 'aiogram.filters', 'aiogram.filters.command', 'aiogram.types',
+    'aiogram.fsm', 'aiogram.fsm.context', 'aiogram.fsm.state',
+    'aiogram.fsm.storage', 'aiogram.fsm.storage.memory',
+    'dotenv',
+]
+for module_name in OPTIONAL_MODULES:
+    try:
+        importlib.import_module(module_name)
+    except ImportError:
+        sys.modules[module_name] = MagicMock()
+
+# Ensure we're in testing mode before the config is imported, so the tests
+# run against an in-memory SQLite database instead of Postgres
+os.environ["PYTEST_CURRENT_TEST"] = "yes"
+
+# Set test environment variables once for every test module
+os.environ["BOT_TOKEN"] = "TEST_BOT_TOKEN"
+os.environ["DB_HOST"] = "localhost"
+os.environ["DB_PORT"] = "5432"
+os.environ["DB_NAME"] = "asbolsyn_test"
+os.environ["DB_USER"] = "postgres"
+os.environ["DB_PASSWORD"] = "password"
+os.environ["ADMIN_CHAT_ID"] = "123456789"
+
+# Import the bot once with the Bot class mocked to avoid token validation;
+# test modules then import handlers from the already loaded src.bot
+with patch('aiogram.Bot') as MockBot:
+    MockBot.return_value = MagicMock()
+    import src.bot
+
 from tortoise import Tortoise
 from src.db import init_db, close_db
 from src.config import TESTING
 
-# Ensure we're in testing mode
-os.environ["PYTEST_CURRENT_TEST"] = "yes"
+@pytest.fixture(scope="session")
+def event_loop():
+    """One event loop for the whole session, shared by the session database fixture"""
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
 
-@pytest_asyncio.fixture(scope="session", autouse=True)
+@pytest.fixture(scope="session", autouse=True)
 async def initialize_tests_db():
     """Initialize test database before running tests and clean up after"""
     await init_db()
@@ -21,9 +64,8 @@ async def initialize_tests_db():
     # Clean up after tests
     await close_db()
 
-@pytest_asyncio.fixture(scope="function", autouse=True)
-async def clean_db():
-    """Clean database before each test"""
+async def clear_test_tables():
+    """Delete all rows created by the tests"""
     conn = Tortoise.get_connection("default")
     
     # Only run if we're using in-memory SQLite (for testing)
@@ -32,5 +74,49 @@ async def clean_db():
         await conn.execute_script("DELETE FROM meals")
         await conn.execute_script("DELETE FROM vendors")
         await conn.execute_script("DELETE FROM consumers")
+        await conn.execute_script("DELETE FROM metrics")
+        await conn.execute_script("DELETE FROM metric_daily_rollups")
+
+@pytest.fixture(scope="function", autouse=True)
+async def clean_db(request):
+    """Clean database before each test"""
+    # Modules marked shared_data seed their rows once and reuse them across tests
+    if not request.node.get_closest_marker("shared_data"):
+        await clear_test_tables()
     
-    yield 
\ No newline at end of file
+    yield
+
+# Consumer ID used for the mocked Telegram user
+TEST_CONSUMER_ID = 54321
+
+@pytest.fixture(scope="module")
+def message_mock():
+    """Message mock built once per module"""
+    # No spec: the handlers only use answer, text, location and from_user,
+    # and building a spec walks every attribute of the aiogram type
+    message = AsyncMock()
+    # The handlers only read from_user.id, a plain namespace is enough
+    message.from_user = SimpleNamespace(id=TEST_CONSUMER_ID)
+    return message
+
+@pytest.fixture
+def message(message_mock):
+    """The module's message mock with calls and per-test attributes reset"""
+    message_mock.reset_mock()
+    message_mock.text = None
+    message_mock.location = None
+    return message_mock
+
+@pytest.fixture(scope="module")
+def callback_query_mock():
+    """CallbackQuery mock built once per module"""
+    callback_query = AsyncMock()
+    callback_query.message = AsyncMock()
+    return callback_query
+
+@pytest.fixture
+def callback_query(callback_query_mock):
+    """The module's callback query mock with calls and data reset"""
+    callback_query_mock.reset_mock()
+    callback_query_mock.data = None
+    return callback_query_mock
@@ -1,142 +1,126 @@
 import pytest
-from unittest.mock import AsyncMock, patch, MagicMock
-from aiogram.types import Message, User
 from aiogram.fsm.context import FSMContext
-from tortoise.contrib.test import initializer, finalizer
+import datetime
 
-import os
-import sys
+# The test environment and the mocked Bot are set up in conftest
+from src.bot import cmd_browse_meals
+from src.models import Vendor, VendorStatus, Meal, Consumer
+from src.config import ALMATY_TIMEZONE
 
-# Mock environment variables before importing any app modules
-os.environ["BOT_TOKEN"] = "test_token"
-os.environ["ADMIN_CHAT_ID"] = "12345"
-os.environ["PYTEST_CURRENT_TEST"] = "True"
-
-# Mock the Bot class before it gets imported
-with patch('aiogram.Bot') as MockBot:
-    # Configure the mock to avoid token validation
-    mock_bot_instance = MagicMock()
-    MockBot.return_value = mock_bot_instance
-    
-    # Now import the app modules
-    from src.bot import cmd_browse_meals
-    from src.models import Vendor, VendorStatus, Meal, Consumer
-    import datetime
-
-
-@pytest.fixture(scope="module")
-def event_loop():
-    import asyncio
-    loop = asyncio.get_event_loop()
-    yield loop
-    loop.close()
 
+# Text expected (True) or not expected (False) in the browse listing
+BROWSE_EXPECTATIONS = [
+    ("Test Meal 1", True),
+    ("1500", True),
+    ("Test Vendor 1", True),
+    ("Test Meal 2", True),
+    ("2000.5", True),
+    ("Test Vendor 2", True),
+    ("Inactive Meal", False),
+    ("Zero Quantity Meal", False),
+]
 
-@pytest.fixture(scope="function")
-async def setup_db():
-    await initializer()
-    yield
-    await finalizer()
 
-
-@pytest.fixture
-async def setup_test_data(setup_db):
-    # Create test vendors
-    vendor1 = await Vendor.create(
-        telegram_id=12345,
-        name="Test Vendor 1",
-        contact_phone="+77771112233",
-        status=VendorStatus.APPROVED
-    )
-    
-    vendor2 = await Vendor.create(
-        telegram_id=12346,
-        name="Test Vendor 2",
-        contact_phone="+77771112244",
-        status=VendorStatus.APPROVED
-    )
-    
-    # Create test consumer
-    consumer = await Consumer.create(telegram_id=54321)
-    
-    # Create test meals
-    now = datetime.datetime.now()
-    pickup_start = now + datetime.timedelta(hours=2)
-    pickup_end = now + datetime.timedelta(hours=3)
-    
-    # Create active meals
-    meal1 = await Meal.create(
+# Clock read once per worker process so every test seeds the same pickup
+# window. It stays relative to the real time because the browse handler
+# compares pickup times against the current clock, and is read in Almaty
+# time because a naive value would be stored as Almaty time.
+_NOW = datetime.datetime.now(ALMATY_TIMEZONE)
+_PICKUP_START = _NOW + datetime.timedelta(hours=2)
+_PICKUP_END = _NOW + datetime.timedelta(hours=3)
+# (vendor index, Meal fields) of each test meal
+_MEAL_KWARGS = [
+    # Active meals
+    (0, dict(
         name="Test Meal 1",
         description="Delicious test meal 1",
         price=1500.00,
         quantity=2,
-        pickup_start_time=pickup_start,
-        pickup_end_time=pickup_end,
+        pickup_start_time=_PICKUP_START,
+        pickup_end_time=_PICKUP_END,
         location_address="Test Address 1",
         location_latitude=43.25,
         location_longitude=76.95,
         is_active=True,
-        vendor=vendor1
-    )
-    
-    meal2 = await Meal.create(
+    )),
+    (1, dict(
         name="Test Meal 2",
         description="Delicious test meal 2",
         price=2000.50,
         quantity=3,
-        pickup_start_time=pickup_start,
-        pickup_end_time=pickup_end,
+        pickup_start_time=_PICKUP_START,
+        pickup_end_time=_PICKUP_END,
         location_address="Test Address 2",
         location_latitude=43.26,
         location_longitude=76.96,
         is_active=True,
-        vendor=vendor2
-    )
-    
-    # Create an inactive meal (should not be shown in browse)
-    meal3 = await Meal.create(
+    )),
+    # Inactive meal (should not be shown in browse)
+    (0, dict(
         name="Inactive Meal",
         description="This meal should not appear in browse",
         price=1000.00,
         quantity=1,
-        pickup_start_time=pickup_start,
-        pickup_end_time=pickup_end,
+        pickup_start_time=_PICKUP_START,
+        pickup_end_time=_PICKUP_END,
         location_address="Test Address 3",
         location_latitude=43.27,
         location_longitude=76.97,
         is_active=False,
-        vendor=vendor1
-    )
-    
-    # Create a meal with zero quantity (should not be shown in browse)
-    meal4 = await Meal.create(
+    )),
+    # Meal with zero quantity (should not be shown in browse)
+    (1, dict(
         name="Zero Quantity Meal",
         description="This meal should not appear in browse",
         price=1200.00,
         quantity=0,
-        pickup_start_time=pickup_start,
-        pickup_end_time=pickup_end,
+        pickup_start_time=_PICKUP_START,
+        pickup_end_time=_PICKUP_END,
         location_address="Test Address 4",
         location_latitude=43.28,
         location_longitude=76.98,
         is_active=True,
-        vendor=vendor2
+    )),
+]
+
+
+@pytest.fixture
+async def setup_test_data():
+    # Create test vendors
+    vendor1 = await Vendor.create(
+        telegram_id=12345,
+        name="Test Vendor 1",
+        contact_phone="+77771112233",
+        status=VendorStatus.APPROVED
+    )
+    
+    vendor2 = await Vendor.create(
+        telegram_id=12346,
+        name="Test Vendor 2",
+        contact_phone="+77771112244",
+        status=VendorStatus.APPROVED
     )
     
+    # Create test consumer
+    consumer = await Consumer.create(telegram_id=54321)
+    
+    # Create test meals
+    vendors = [vendor1, vendor2]
+    meals = [
+        Meal(vendor=vendors[vendor_index], **meal_kwargs)
+        for vendor_index, meal_kwargs in _MEAL_KWARGS
+    ]
+    # Insert all meals in a single statement
+    await Meal.bulk_create(meals)
+    
     return {
-        "vendors": [vendor1, vendor2],
+        "vendors": vendors,
         "consumer": consumer,
-        "meals": [meal1, meal2, meal3, meal4]
+        "meals": meals
     }
 
 
-@pytest.mark.asyncio
-async def test_browse_meals_with_available_meals(setup_test_data):
-    # Mock message
-    message = AsyncMock(spec=Message)
-    message.from_user = AsyncMock(spec=User)
-    message.from_user.id = 54321  # Consumer ID from setup
-    
+async def test_browse_meals_with_available_meals(setup_test_data, message):
     # Call the browse meals command
     await cmd_browse_meals(message)
     
@@ -147,27 +131,13 @@ async def test_browse_meals_with_available_meals(setup_test_data):
     args = message.answer.call_args[0]
     message_text = args[0]
     
-    # Check that the message contains both active meals
-    assert "Test Meal 1" in message_text
-    assert "1500" in message_text
-    assert "Test Vendor 1" in message_text
-    
-    assert "Test Meal 2" in message_text
-    assert "2000.5" in message_text
-    assert "Test Vendor 2" in message_text
-    
-    # Check that inactive and zero quantity meals are not included
-    assert "Inactive Meal" not in message_text
-    assert "Zero Quantity Meal" not in message_text
+    # Check that both active meals are listed and the inactive and
+    # zero quantity meals are not
+    for text, expected in BROWSE_EXPECTATIONS:
+        assert (text in message_text) == expected, f"{text!r} shown: {not expected}"
 
 
-@pytest.mark.asyncio
-async def test_browse_meals_no_available_meals(setup_db):
-    # Mock message
-    message = AsyncMock(spec=Message)
-    message.from_user = AsyncMock(spec=User)
-    message.from_user.id = 54321
-    
+async def test_browse_meals_no_available_meals(message):
     # Call the browse meals command with no meals in DB
     await cmd_browse_meals(message)
     
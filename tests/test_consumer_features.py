@@ -1,148 +1,161 @@
 import pytest
-from unittest.mock import AsyncMock, patch, MagicMock
-from aiogram.types import Message, User, Location, CallbackQuery
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+from aiogram.types import Location
 from aiogram.fsm.context import FSMContext
-from tortoise.contrib.test import initializer, finalizer
+import datetime
 
-import os
-import sys
+# The test environment and the mocked Bot are set up in conftest
+from src.bot import cmd_meals_nearby, process_meals_nearby, calculate_distance, filter_meals_by_distance, cmd_view_meal, process_buy_callback, TEXT
+from src.models import Vendor, VendorStatus, Meal, Consumer
+from src.config import ALMATY_TIMEZONE
+from tests.conftest import clear_test_tables
 
-# Mock environment variables before importing any app modules
-os.environ["BOT_TOKEN"] = "test_token"
-os.environ["ADMIN_CHAT_ID"] = "12345"
-os.environ["PYTEST_CURRENT_TEST"] = "True"
-
-# Mock the Bot class before it gets imported
-with patch('aiogram.Bot') as MockBot:
-    # Configure the mock to avoid token validation
-    mock_bot_instance = MagicMock()
-    MockBot.return_value = mock_bot_instance
-    
-    # Now import the app modules
-    from src.bot import cmd_meals_nearby, process_meals_nearby, calculate_distance, filter_meals_by_distance, cmd_view_meal, process_buy_callback, TEXT
-    from src.models import Vendor, VendorStatus, Meal, Consumer
-    import datetime
-
-
-@pytest.fixture(scope="module")
-def event_loop():
-    import asyncio
-    loop = asyncio.get_event_loop()
-    yield loop
-    loop.close()
+# The tests below only read the seeded rows, so they are created once per module
+pytestmark = pytest.mark.shared_data
 
 
-@pytest.fixture(scope="function")
-async def setup_db():
-    await initializer()
-    yield
-    await finalizer()
+# Text expected (True) or not expected (False) in the nearby meals listing
+# for a location in Almaty center
+NEARBY_EXPECTATIONS = [
+    ("Test Meal 1", True),
+    ("1500", True),
+    ("Test Meal 2", True),
+    ("2000.5", True),
+    ("Far Away Meal", False),
+    ("Inactive Meal", False),
+]
 
 
-@pytest.fixture
-async def setup_test_data(setup_db):
-    # Create test vendors
-    vendor1 = await Vendor.create(
-        telegram_id=12345,
-        name="Test Vendor 1",
-        contact_phone="+77771112233",
-        status=VendorStatus.APPROVED
-    )
-    
-    vendor2 = await Vendor.create(
-        telegram_id=12346,
-        name="Test Vendor 2",
-        contact_phone="+77771112244",
-        status=VendorStatus.APPROVED
-    )
-    
-    # Create test consumer
-    consumer = await Consumer.create(telegram_id=54321)
-    
-    # Create test meals
-    now = datetime.datetime.now()
-    pickup_start = now + datetime.timedelta(hours=2)
-    pickup_end = now + datetime.timedelta(hours=3)
-    
+# Seed data built once per worker process: the pickup window and the
+# (vendor index, Meal fields) of each test meal. The clock is read in Almaty
+# time, a naive value would be stored as Almaty time and could already be past.
+_NOW = datetime.datetime.now(ALMATY_TIMEZONE)
+_PICKUP_START = _NOW + datetime.timedelta(hours=2)
+_PICKUP_END = _NOW + datetime.timedelta(hours=3)
+_MEAL_KWARGS = [
     # Meal in Almaty city center
-    meal1 = await Meal.create(
+    (0, dict(
         name="Test Meal 1",
         description="Delicious test meal 1",
         price=1500.00,
         quantity=2,
-        pickup_start_time=pickup_start,
-        pickup_end_time=pickup_end,
+        pickup_start_time=_PICKUP_START,
+        pickup_end_time=_PICKUP_END,
         location_address="Test Address 1",
         location_latitude=43.238949,  # Almaty coordinates
         location_longitude=76.889709,
         is_active=True,
-        vendor=vendor1
-    )
-    
+    )),
     # Meal in Almaty outskirts
-    meal2 = await Meal.create(
+    (1, dict(
         name="Test Meal 2",
         description="Delicious test meal 2",
         price=2000.50,
         quantity=3,
-        pickup_start_time=pickup_start,
-        pickup_end_time=pickup_end,
+        pickup_start_time=_PICKUP_START,
+        pickup_end_time=_PICKUP_END,
         location_address="Test Address 2",
         location_latitude=43.346065,  # ~12km from city center
         location_longitude=77.005005,
         is_active=True,
-        vendor=vendor2
-    )
-    
+    )),
     # Meal far from Almaty (in Astana)
-    meal3 = await Meal.create(
+    (0, dict(
         name="Far Away Meal",
         description="This meal should not appear in nearby search",
         price=1000.00,
         quantity=1,
-        pickup_start_time=pickup_start,
-        pickup_end_time=pickup_end,
+        pickup_start_time=_PICKUP_START,
+        pickup_end_time=_PICKUP_END,
         location_address="Test Address 3",
         location_latitude=51.128207,  # Astana coordinates
         location_longitude=71.430420,
         is_active=True,
-        vendor=vendor1
-    )
-    
+    )),
     # Inactive meal
-    meal4 = await Meal.create(
+    (1, dict(
         name="Inactive Meal",
         description="This meal should not appear in results",
         price=1200.00,
         quantity=2,
-        pickup_start_time=pickup_start,
-        pickup_end_time=pickup_end,
+        pickup_start_time=_PICKUP_START,
+        pickup_end_time=_PICKUP_END,
         location_address="Test Address 4",
         location_latitude=43.238949,
         location_longitude=76.889709,
         is_active=False,
-        vendor=vendor2
+    )),
+]
+
+
+@pytest.fixture(scope="module")
+async def setup_test_data():
+    # Start from an empty database, the per-test cleanup is skipped in this module
+    await clear_test_tables()
+    
+    # Create test vendors
+    vendor1 = await Vendor.create(
+        telegram_id=12345,
+        name="Test Vendor 1",
+        contact_phone="+77771112233",
+        status=VendorStatus.APPROVED
     )
     
+    vendor2 = await Vendor.create(
+        telegram_id=12346,
+        name="Test Vendor 2",
+        contact_phone="+77771112244",
+        status=VendorStatus.APPROVED
+    )
+    
+    # Create test consumer
+    consumer = await Consumer.create(telegram_id=54321)
+    
+    # Create test meals
+    vendors = [vendor1, vendor2]
+    meals = [
+        Meal(vendor=vendors[vendor_index], **meal_kwargs)
+        for vendor_index, meal_kwargs in _MEAL_KWARGS
+    ]
+    # Insert all meals in a single statement
+    await Meal.bulk_create(meals)
+    
+    # bulk_create doesn't set the primary keys, so read the rows back once
+    # and let the tests look the meals up by name
+    meals_by_name = {meal.name: meal for meal in await Meal.all()}
+    
     return {
-        "vendors": [vendor1, vendor2],
+        "vendors": vendors,
         "consumer": consumer,
-        "meals": [meal1, meal2, meal3, meal4]
+        "meals": meals,
+        "meals_by_name": meals_by_name
     }
 
 
-def test_calculate_distance():
-    """Test the Haversine distance calculation function"""
+# (from, to, min km, max km) cases for the Haversine distance calculation
+ALMATY_CENTER = (43.238949, 76.889709)
+ALMATY_NORTH = (43.346065, 77.005005)
+ASTANA = (51.128207, 71.430420)
+DISTANCE_CASES = [
     # Almaty to Astana, should be ~970 km
-    distance = calculate_distance(43.238949, 76.889709, 51.128207, 71.430420)
-    assert 950 < distance < 990
-    
-    # Close points within Almaty, should be ~12 km
-    distance = calculate_distance(43.238949, 76.889709, 43.346065, 77.005005)
-    assert 10 < distance < 15
+    (ALMATY_CENTER, ASTANA, 950, 990),
+    # Same route in reverse, the distance is symmetric
+    (ASTANA, ALMATY_CENTER, 950, 990),
+    # Close points within Almaty, should be ~15 km
+    (ALMATY_CENTER, ALMATY_NORTH, 10, 20),
+    # Same point, no distance
+    (ALMATY_CENTER, ALMATY_CENTER, 0, 0.001),
+]
+
+
+@pytest.mark.parametrize("origin, destination, min_km, max_km", DISTANCE_CASES)
+def test_calculate_distance(origin, destination, min_km, max_km):
+    """Test the Haversine distance calculation function"""
+    distance = calculate_distance(*origin, *destination)
+    assert min_km <= distance < max_km
 
 
-@pytest.mark.asyncio
 async def test_filter_meals_by_distance(setup_test_data):
     """Test filtering meals by distance"""
     meals = await Meal.filter(is_active=True).all()
@@ -154,22 +167,19 @@ async def test_filter_meals_by_distance(setup_test_data):
     # From Almaty center, with 5km radius (should only get meal1)
     filtered_meals = await filter_meals_by_distance(meals, 43.238949, 76.889709, 5.0)
     assert len(filtered_meals) == 1
-    assert filtered_meals[0].name == "Test Meal 1"
+    meal, distance = filtered_meals[0]
+    assert meal.name == "Test Meal 1"
+    assert distance < 0.001
     
     # From Astana (should only get meal3)
     filtered_meals = await filter_meals_by_distance(meals, 51.128207, 71.430420, 20.0)
     assert len(filtered_meals) == 1
-    assert filtered_meals[0].name == "Far Away Meal"
+    meal, distance = filtered_meals[0]
+    assert meal.name == "Far Away Meal"
 
 
-@pytest.mark.asyncio
-async def test_cmd_meals_nearby(setup_test_data):
+async def test_cmd_meals_nearby(setup_test_data, message):
     """Test the meals_nearby command"""
-    # Mock message
-    message = AsyncMock(spec=Message)
-    message.from_user = AsyncMock(spec=User)
-    message.from_user.id = 54321  # Consumer ID from setup
-    
     # Mock state
     state = AsyncMock(spec=FSMContext)
     
@@ -184,13 +194,9 @@ async def test_cmd_meals_nearby(setup_test_data):
     assert "reply_markup" in kwargs
 
 
-@pytest.mark.asyncio
-async def test_process_meals_nearby(setup_test_data):
+async def test_process_meals_nearby(setup_test_data, message):
     """Test processing the location for nearby meals"""
     # Mock message with location
-    message = AsyncMock(spec=Message)
-    message.from_user = AsyncMock(spec=User)
-    message.from_user.id = 54321  # Consumer ID from setup
     message.location = Location(latitude=43.238949, longitude=76.889709)  # Almaty center
     
     # Mock state
@@ -209,35 +215,24 @@ async def test_process_meals_nearby(setup_test_data):
     args = message.answer.call_args[0]
     message_text = args[0]
     
-    # Check that the message contains the nearby meal (meal1)
-    assert "Test Meal 1" in message_text
-    assert "1500" in message_text
-    
-    # Check that the message contains the meal that's a bit further (meal2)
-    assert "Test Meal 2" in message_text
-    assert "2000.5" in message_text
-    
-    # Check that the far away meal is not included
-    assert "Far Away Meal" not in message_text
-    
-    # Check that the inactive meal is not included
-    assert "Inactive Meal" not in message_text
+    # Check that the nearby meal and the one a bit further are listed, and
+    # the far away and inactive meals are not
+    for text, expected in NEARBY_EXPECTATIONS:
+        assert (text in message_text) == expected, f"{text!r} shown: {not expected}"
 
 
-@pytest.mark.asyncio
-async def test_view_meal(setup_test_data):
+async def test_view_meal(setup_test_data, message):
     """Test the view_meal command"""
     # Get meal ID from setup data
-    meal = await Meal.filter(name="Test Meal 1").first()
+    meal = setup_test_data["meals_by_name"]["Test Meal 1"]
     
     # Mock message
-    message = AsyncMock(spec=Message)
-    message.from_user = AsyncMock(spec=User)
-    message.from_user.id = 54321  # Consumer ID from setup
     message.text = f"/view_meal {meal.id}"
     
-    # Call the view meal command
-    await cmd_view_meal(message)
+    # The command wraps the message in a CallbackQuery, whose validation
+    # rejects the mocks, so build it as a mock with the same fields
+    with patch("src.bot.types.CallbackQuery", lambda **fields: AsyncMock(**fields)):
+        await cmd_view_meal(message)
     
     # Check that the correct message is sent
     message.answer.assert_called_once()
@@ -257,19 +252,20 @@ async def test_view_meal(setup_test_data):
     assert "reply_markup" in kwargs
 
 
-@pytest.mark.asyncio
-async def test_process_buy_callback(setup_test_data):
+async def test_process_buy_callback(setup_test_data, callback_query):
     """Test the buy meal callback handler"""
     # Get meal ID from setup data
-    meal = await Meal.filter(name="Test Meal 1").first()
+    meal = setup_test_data["meals_by_name"]["Test Meal 1"]
     
-    # Mock callback query
-    callback_query = AsyncMock(spec=CallbackQuery)
-    callback_query.data = f"buy_meal:{meal.id}"
-    callback_query.message = AsyncMock(spec=Message)
+    # Mock callback query buying one portion
+    callback_query.from_user = SimpleNamespace(id=setup_test_data["consumer"].telegram_id)
+    callback_query.data = f"buy_meal:{meal.id}:1"
     
-    # Call the buy meal callback handler
-    await process_buy_callback(callback_query)
+    # Call the buy meal callback handler with the external payment flow,
+    # without starting the simulated provider callback
+    with patch("src.bot.payment_gateway.is_telegram_payments_available", return_value=False), \
+            patch("src.bot.simulate_payment_webhook", AsyncMock()):
+        await process_buy_callback(callback_query)
     
     # Check that the callback is answered
     callback_query.answer.assert_called_once()
@@ -1,40 +1,40 @@
-import unittest
-import asyncio
-import os
+import pytest
 import sys
 import datetime
+from dataclasses import dataclass
+from types import MappingProxyType, SimpleNamespace
 from decimal import Decimal
-from unittest.mock import MagicMock, patch, AsyncMock
+from functools import lru_cache
+from unittest.mock import MagicMock, AsyncMock
 
-# Add the parent directory to sys.path to import the src modules
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Test environment variables are set once in conftest
 
-# Set test environment variables
-os.environ["BOT_TOKEN"] = "TEST_BOT_TOKEN"
-os.environ["DB_HOST"] = "localhost"
-os.environ["DB_PORT"] = "5432"
-os.environ["DB_NAME"] = "asbolsyn_test"
-os.environ["DB_USER"] = "postgres"
-os.environ["DB_PASSWORD"] = "password"
-os.environ["ADMIN_CHAT_ID"] = "123456789"
+# Fixed date for the mock meals and pickup time handlers, the tests never
+# compare against the real clock
+_NOW = datetime.datetime(2025, 1, 1)
 
 # Mock classes for FSM
+@dataclass(frozen=True, slots=True)
 class MockState:
-    def __init__(self, state_name):
-        self.state = state_name
+    state: str
     
     def __str__(self):
         return self.state
 
-class MockStatesGroup:
-    waiting_for_name = MockState('waiting_for_name')
-    waiting_for_description = MockState('waiting_for_description')
-    waiting_for_price = MockState('waiting_for_price')
-    waiting_for_quantity = MockState('waiting_for_quantity')
-    waiting_for_pickup_start = MockState('waiting_for_pickup_start')
-    waiting_for_pickup_end = MockState('waiting_for_pickup_end')
-    waiting_for_location_address = MockState('waiting_for_location_address')
-    waiting_for_location_coords = MockState('waiting_for_location_coords')
+# Meal creation states, each built once and shared by every test
+MockStatesGroup = SimpleNamespace(**{
+    state_name: MockState(state_name)
+    for state_name in (
+        'waiting_for_name',
+        'waiting_for_description',
+        'waiting_for_price',
+        'waiting_for_quantity',
+        'waiting_for_pickup_start',
+        'waiting_for_pickup_end',
+        'waiting_for_location_address',
+        'waiting_for_location_coords',
+    )
+})
 
 # Create mock classes for the models
 class MockVendorStatus:
@@ -54,13 +54,18 @@ class MockVendor:
     contact_phone = "+77771234567"
     status = MockVendorStatus.APPROVED
     
+    # Telegram IDs of the registered test vendors
+    _TELEGRAM_IDS = frozenset({12345})
+    
     @classmethod
     async def filter(cls, **kwargs):
-        if 'telegram_id' in kwargs and kwargs['telegram_id'] == 12345:
-            mock_vendor = MockVendor()
-            mock_vendor.telegram_id = 12345
-            return [mock_vendor]
-        return []
+        telegram_id = kwargs.get('telegram_id')
+        if telegram_id not in cls._TELEGRAM_IDS:
+            return []
+        
+        mock_vendor = MockVendor()
+        mock_vendor.telegram_id = telegram_id
+        return [mock_vendor]
     
     async def save(self):
         pass
@@ -71,8 +76,8 @@ class MockMeal:
     description = "Test Description"
     price = Decimal("1500.00")
     quantity = 5
-    pickup_start_time = datetime.datetime.now()
-    pickup_end_time = datetime.datetime.now() + datetime.timedelta(hours=3)
+    pickup_start_time = _NOW.replace(hour=14)
+    pickup_end_time = _NOW.replace(hour=17)
     location_address = "Test Address"
     location_latitude = 43.238949
     location_longitude = 76.889709
@@ -86,30 +91,26 @@ class MockMeal:
             setattr(mock_meal, key, value)
         return mock_meal
     
+    # IDs of the existing test meals
+    _MEAL_IDS = frozenset({1})
+    
     @classmethod
     async def filter(cls, **kwargs):
-        if 'id' in kwargs and kwargs['id'] == 1 and 'is_active' in kwargs and kwargs['is_active']:
-            return [MockMeal()]
-        elif 'vendor' in kwargs and 'is_active' in kwargs and kwargs['is_active']:
+        # Only active meals, looked up by ID or listed for a vendor
+        if not kwargs.get('is_active'):
+            return []
+        if kwargs.get('id') in cls._MEAL_IDS or 'vendor' in kwargs:
             return [MockMeal()]
         return []
     
     async def save(self):
         pass
 
-# Mock the imports
-sys.modules['src.models'] = MagicMock()
-sys.modules['src.models'].Vendor = MockVendor
-sys.modules['src.models'].VendorStatus = MockVendorStatus
-sys.modules['src.models'].Meal = MockMeal
-
-sys.modules['aiogram.fsm.state'] = MagicMock()
-sys.modules['aiogram.fsm.state'].State = MagicMock(side_effect=MockState)
-sys.modules['aiogram.fsm.state'].StatesGroup = MagicMock(side_effect=MockStatesGroup)
-
-# Mock the src.bot module to avoid importing the real one
-sys.modules['src.bot'] = MagicMock()
-sys.modules['src.bot'].MealCreation = MockStatesGroup()
+@lru_cache(maxsize=1440)
+def _parse_hhmm(time_str: str) -> tuple[int, int]:
+    """Parse an HH:MM string into (hours, minutes), raising ValueError if malformed"""
+    hours, minutes = time_str.split(':')
+    return int(hours), int(minutes)
 
 # Create test handler functions to simulate the real ones
 async def mock_cmd_add_meal(message, state):
@@ -171,10 +172,9 @@ async def mock_process_meal_pickup_start(message, state):
     """Simulate the process_meal_pickup_start handler."""
     try:
         time_str = message.text.strip()
-        hours, minutes = map(int, time_str.split(':'))
+        hours, minutes = _parse_hhmm(time_str)
         
-        now = datetime.datetime.now()
-        pickup_start = now.replace(hour=hours, minute=minutes)
+        pickup_start = _NOW.replace(hour=hours, minute=minutes)
         
         await state.update_data(
             pickup_start_str=time_str,
@@ -190,10 +190,9 @@ async def mock_process_meal_pickup_end(message, state):
     """Simulate the process_meal_pickup_end handler."""
     try:
         time_str = message.text.strip()
-        hours, minutes = map(int, time_str.split(':'))
+        hours, minutes = _parse_hhmm(time_str)
         
-        now = datetime.datetime.now()
-        pickup_end = now.replace(hour=hours, minute=minutes)
+        pickup_end = _NOW.replace(hour=hours, minute=minutes)
         
         data = await state.get_data()
         pickup_start = data.get('pickup_start')
@@ -304,312 +303,164 @@ async def mock_cmd_delete_meal(message):
     except (ValueError, TypeError):
         await message.answer("Invalid ID format")
 
-# Replace the module functions with our mock implementations
-sys.modules['src.bot'].cmd_add_meal = mock_cmd_add_meal
-sys.modules['src.bot'].process_meal_name = mock_process_meal_name
-sys.modules['src.bot'].process_meal_description = mock_process_meal_description
-sys.modules['src.bot'].process_meal_price = mock_process_meal_price
-sys.modules['src.bot'].process_meal_quantity = mock_process_meal_quantity
-sys.modules['src.bot'].process_meal_pickup_start = mock_process_meal_pickup_start
-sys.modules['src.bot'].process_meal_pickup_end = mock_process_meal_pickup_end
-sys.modules['src.bot'].process_meal_location_address = mock_process_meal_location_address
-sys.modules['src.bot'].process_meal_location_coords = mock_process_meal_location_coords
-sys.modules['src.bot'].cmd_my_meals = mock_cmd_my_meals
-sys.modules['src.bot'].cmd_delete_meal = mock_cmd_delete_meal
-
-
-class TestMealCreation(unittest.TestCase):
-    """Tests for meal creation and management process."""
-
-    def setUp(self):
-        """Set up test environment."""
-        # Mock FSM context
-        self.mock_state = AsyncMock()
-        self.mock_state.set_state = AsyncMock()
-        self.mock_state.update_data = AsyncMock()
-        self.mock_state.get_data = AsyncMock(return_value={
-            "name": "Test Meal",
-            "description": "Test Description",
-            "price": 1500.0,
-            "quantity": 5,
-            "pickup_start": datetime.datetime.now(),
-            "pickup_start_str": "14:00",
-            "pickup_end": datetime.datetime.now() + datetime.timedelta(hours=3),
-            "pickup_end_str": "17:00",
-            "location_address": "Test Address"
-        })
-        self.mock_state.clear = AsyncMock()
-        
-        # Mock message
-        self.mock_message = AsyncMock()
-        self.mock_message.from_user = AsyncMock()
-        self.mock_message.from_user.id = 12345
-        self.mock_message.answer = AsyncMock()
-        self.mock_message.text = "Test input"
-        
-        # Create a mock location
-        self.mock_location = MockLocation(43.238949, 76.889709)
-        self.mock_message.location = self.mock_location
-
-    def test_meal_creation_flow(self):
-        """Test the meal creation flow."""
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        try:
-            # Test add_meal command
-            loop.run_until_complete(self._test_add_meal_command())
-            
-            # Test meal name input
-            loop.run_until_complete(self._test_meal_name_input())
-            
-            # Test meal description input
-            loop.run_until_complete(self._test_meal_description_input())
-            
-            # Test meal price input
-            loop.run_until_complete(self._test_meal_price_input())
-            
-            # Test meal quantity input
-            loop.run_until_complete(self._test_meal_quantity_input())
-            
-            # Test pickup start time input
-            loop.run_until_complete(self._test_pickup_start_input())
-            
-            # Test pickup end time input
-            loop.run_until_complete(self._test_pickup_end_input())
-            
-            # Test location address input
-            loop.run_until_complete(self._test_location_address_input())
-            
-            # Test location coordinates input
-            loop.run_until_complete(self._test_location_coords_input())
-            
-            # Test my_meals command
-            loop.run_until_complete(self._test_my_meals_command())
-            
-            # Test delete_meal command
-            loop.run_until_complete(self._test_delete_meal_command())
-        finally:
-            loop.close()
-
-    async def _test_add_meal_command(self):
-        """Test the /add_meal command."""
-        from src.bot import cmd_add_meal
-        
-        # Reset mocks
-        self.mock_state.set_state.reset_mock()
-        self.mock_message.answer.reset_mock()
-        
-        # Execute command
-        await cmd_add_meal(self.mock_message, self.mock_state)
-        
-        # Verify state was set
-        self.mock_state.set_state.assert_called_once()
-        # Verify message was sent
-        self.mock_message.answer.assert_called_once()
-
-    async def _test_meal_name_input(self):
-        """Test the handler for meal name input."""
-        from src.bot import process_meal_name
-        
-        # Reset mocks
-        self.mock_state.set_state.reset_mock()
-        self.mock_state.update_data.reset_mock()
-        self.mock_message.answer.reset_mock()
-        
-        # Set test input
-        self.mock_message.text = "Test Meal"
-        
-        # Execute handler
-        await process_meal_name(self.mock_message, self.mock_state)
-        
-        # Verify data was updated
-        self.mock_state.update_data.assert_called_once_with(name="Test Meal")
-        # Verify state was changed
-        self.mock_state.set_state.assert_called_once()
-        # Verify message was sent
-        self.mock_message.answer.assert_called_once()
-
-    async def _test_meal_description_input(self):
-        """Test the handler for meal description input."""
-        from src.bot import process_meal_description
-        
-        # Reset mocks
-        self.mock_state.set_state.reset_mock()
-        self.mock_state.update_data.reset_mock()
-        self.mock_message.answer.reset_mock()
-        
-        # Set test input
-        self.mock_message.text = "Test Description"
-        
-        # Execute handler
-        await process_meal_description(self.mock_message, self.mock_state)
-        
-        # Verify data was updated
-        self.mock_state.update_data.assert_called_once_with(description="Test Description")
-        # Verify state was changed
-        self.mock_state.set_state.assert_called_once()
-        # Verify message was sent
-        self.mock_message.answer.assert_called_once()
-
-    async def _test_meal_price_input(self):
-        """Test the handler for meal price input."""
-        from src.bot import process_meal_price
-        
-        # Reset mocks
-        self.mock_state.set_state.reset_mock()
-        self.mock_state.update_data.reset_mock()
-        self.mock_message.answer.reset_mock()
-        
-        # Set test input
-        self.mock_message.text = "1500"
-        
-        # Execute handler
-        await process_meal_price(self.mock_message, self.mock_state)
-        
-        # Verify data was updated
-        self.mock_state.update_data.assert_called_once()
-        # Verify state was changed
-        self.mock_state.set_state.assert_called_once()
-        # Verify message was sent
-        self.mock_message.answer.assert_called_once()
-
-    async def _test_meal_quantity_input(self):
-        """Test the handler for meal quantity input."""
-        from src.bot import process_meal_quantity
-        
-        # Reset mocks
-        self.mock_state.set_state.reset_mock()
-        self.mock_state.update_data.reset_mock()
-        self.mock_message.answer.reset_mock()
-        
-        # Set test input
-        self.mock_message.text = "5"
-        
-        # Execute handler
-        await process_meal_quantity(self.mock_message, self.mock_state)
-        
-        # Verify data was updated
-        self.mock_state.update_data.assert_called_once_with(quantity=5)
-        # Verify state was changed
-        self.mock_state.set_state.assert_called_once()
-        # Verify message was sent
-        self.mock_message.answer.assert_called_once()
-
-    async def _test_pickup_start_input(self):
-        """Test the handler for pickup start time input."""
-        from src.bot import process_meal_pickup_start
-        
-        # Reset mocks
-        self.mock_state.set_state.reset_mock()
-        self.mock_state.update_data.reset_mock()
-        self.mock_message.answer.reset_mock()
-        
-        # Set test input
-        self.mock_message.text = "14:00"
-        
-        # Execute handler
-        await process_meal_pickup_start(self.mock_message, self.mock_state)
-        
-        # Verify data was updated
-        self.mock_state.update_data.assert_called_once()
-        # Verify state was changed
-        self.mock_state.set_state.assert_called_once()
-        # Verify message was sent
-        self.mock_message.answer.assert_called_once()
-
-    async def _test_pickup_end_input(self):
-        """Test the handler for pickup end time input."""
-        from src.bot import process_meal_pickup_end
-        
-        # Reset mocks
-        self.mock_state.set_state.reset_mock()
-        self.mock_state.update_data.reset_mock()
-        self.mock_message.answer.reset_mock()
-        
-        # Set test input
-        self.mock_message.text = "17:00"
-        
-        # Execute handler
-        await process_meal_pickup_end(self.mock_message, self.mock_state)
-        
-        # Verify data was updated
-        self.mock_state.update_data.assert_called_once()
-        # Verify state was changed
-        self.mock_state.set_state.assert_called_once()
-        # Verify message was sent
-        self.mock_message.answer.assert_called_once()
-
-    async def _test_location_address_input(self):
-        """Test the handler for location address input."""
-        from src.bot import process_meal_location_address
-        
-        # Reset mocks
-        self.mock_state.set_state.reset_mock()
-        self.mock_state.update_data.reset_mock()
-        self.mock_message.answer.reset_mock()
-        
-        # Set test input
-        self.mock_message.text = "Test Address"
-        
-        # Execute handler
-        await process_meal_location_address(self.mock_message, self.mock_state)
-        
-        # Verify data was updated
-        self.mock_state.update_data.assert_called_once_with(location_address="Test Address")
-        # Verify state was changed
-        self.mock_state.set_state.assert_called_once()
-        # Verify message was sent
-        self.mock_message.answer.assert_called_once()
-
-    async def _test_location_coords_input(self):
-        """Test the handler for location coordinates input."""
-        from src.bot import process_meal_location_coords
-        
-        # Reset mocks
-        self.mock_state.clear.reset_mock()
-        self.mock_state.update_data.reset_mock()
-        self.mock_message.answer.reset_mock()
-        
-        # Execute handler
-        await process_meal_location_coords(self.mock_message, self.mock_state)
-        
-        # Verify data was updated
-        self.mock_state.update_data.assert_called_once()
-        # Verify state was cleared
-        self.mock_state.clear.assert_called_once()
-        # Verify message was sent
-        self.mock_message.answer.assert_called_once()
-
-    async def _test_my_meals_command(self):
-        """Test the /my_meals command."""
-        from src.bot import cmd_my_meals
-        
-        # Reset mocks
-        self.mock_message.answer.reset_mock()
-        
-        # Execute command
-        await cmd_my_meals(self.mock_message)
-        
-        # Verify message was sent
-        self.mock_message.answer.assert_called_once()
+# Mock implementations served under the real src.bot names
+MOCK_BOT_ATTRIBUTES = {
+    "MealCreation": MockStatesGroup,
+    "cmd_add_meal": mock_cmd_add_meal,
+    "process_meal_name": mock_process_meal_name,
+    "process_meal_description": mock_process_meal_description,
+    "process_meal_price": mock_process_meal_price,
+    "process_meal_quantity": mock_process_meal_quantity,
+    "process_meal_pickup_start": mock_process_meal_pickup_start,
+    "process_meal_pickup_end": mock_process_meal_pickup_end,
+    "process_meal_location_address": mock_process_meal_location_address,
+    "process_meal_location_coords": mock_process_meal_location_coords,
+    "cmd_my_meals": mock_cmd_my_meals,
+    "cmd_delete_meal": mock_cmd_delete_meal,
+}
+
+@pytest.fixture(autouse=True, scope="module")
+def mock_bot_module():
+    """Serve the mock handlers as src.bot while this module's tests run.
+    
+    The patch is undone after the module, so the other test modules keep
+    the real src.bot and src.models.
+    """
+    mock_bot = MagicMock()
+    for name, value in MOCK_BOT_ATTRIBUTES.items():
+        setattr(mock_bot, name, value)
+    
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setitem(sys.modules, "src.bot", mock_bot)
+        yield mock_bot
+
+
+# Tests for meal creation and management process
+
+# FSM data returned by get_data, shared read-only by every test
+_FIXED_STATE_DATA = MappingProxyType({
+    "name": "Test Meal",
+    "description": "Test Description",
+    "price": 1500.0,
+    "quantity": 5,
+    "pickup_start": _NOW.replace(hour=14),
+    "pickup_start_str": "14:00",
+    "pickup_end": _NOW.replace(hour=17),
+    "pickup_end_str": "17:00",
+    "location_address": "Test Address"
+})
+
+@pytest.fixture
+def ctx():
+    """Fresh FSM context, message and location mocks for each test."""
+    # Mock FSM context; set_state, update_data and clear are created as
+    # AsyncMocks on first access, so only get_data needs configuring
+    mock_state = AsyncMock()
+    mock_state.get_data = AsyncMock(return_value=_FIXED_STATE_DATA)
+    
+    # Mock message
+    mock_message = AsyncMock()
+    mock_message.from_user = SimpleNamespace(id=12345)
+    mock_message.text = "Test input"
+    
+    # Create a mock location
+    mock_location = MockLocation(43.238949, 76.889709)
+    mock_message.location = mock_location
+    
+    return SimpleNamespace(
+        mock_state=mock_state,
+        mock_message=mock_message,
+        mock_location=mock_location
+    )
+
+
+async def test_add_meal_command(ctx):
+    """Test the /add_meal command."""
+    from src.bot import cmd_add_meal
+    
+    # Execute command
+    await cmd_add_meal(ctx.mock_message, ctx.mock_state)
+    
+    # Verify state was set
+    ctx.mock_state.set_state.assert_called_once()
+    # Verify message was sent
+    ctx.mock_message.answer.assert_called_once()
+
+
+# (handler, input text, expected update_data kwargs) for each meal input
+# step; None only checks that the data was updated once
+MEAL_INPUT_CASES = [
+    ("process_meal_name", "Test Meal", {"name": "Test Meal"}),
+    ("process_meal_description", "Test Description", {"description": "Test Description"}),
+    ("process_meal_price", "1500", None),
+    ("process_meal_quantity", "5", {"quantity": 5}),
+    ("process_meal_pickup_start", "14:00", None),
+    ("process_meal_pickup_end", "17:00", None),
+    ("process_meal_location_address", "Test Address", {"location_address": "Test Address"}),
+]
+
+
+@pytest.mark.parametrize(
+    "handler_name, input_text, expected_update",
+    MEAL_INPUT_CASES,
+    ids=[case[0] for case in MEAL_INPUT_CASES]
+)
+async def test_meal_input_step(ctx, handler_name, input_text, expected_update):
+    """Test the handler for each meal input step."""
+    handler = getattr(sys.modules["src.bot"], handler_name)
+    
+    # Set test input
+    ctx.mock_message.text = input_text
+    
+    # Execute handler
+    await handler(ctx.mock_message, ctx.mock_state)
+    
+    # Verify data was updated
+    if expected_update is None:
+        ctx.mock_state.update_data.assert_called_once()
+    else:
+        ctx.mock_state.update_data.assert_called_once_with(**expected_update)
+    # Verify state was changed
+    ctx.mock_state.set_state.assert_called_once()
+    # Verify message was sent
+    ctx.mock_message.answer.assert_called_once()
+
+
+async def test_location_coords_input(ctx):
+    """Test the handler for location coordinates input."""
+    from src.bot import process_meal_location_coords
+    
+    # Execute handler
+    await process_meal_location_coords(ctx.mock_message, ctx.mock_state)
+    
+    # Verify data was updated
+    ctx.mock_state.update_data.assert_called_once()
+    # Verify state was cleared
+    ctx.mock_state.clear.assert_called_once()
+    # Verify message was sent
+    ctx.mock_message.answer.assert_called_once()
 
-    async def _test_delete_meal_command(self):
-        """Test the /delete_meal command."""
-        from src.bot import cmd_delete_meal
-        
-        # Reset mocks
-        self.mock_message.answer.reset_mock()
-        
-        # Set test input
-        self.mock_message.text = "/delete_meal 1"
-        
-        # Execute command
-        await cmd_delete_meal(self.mock_message)
-        
-        # Verify message was sent
-        self.mock_message.answer.assert_called_once()
 
+async def test_my_meals_command(ctx):
+    """Test the /my_meals command."""
+    from src.bot import cmd_my_meals
+    
+    # Execute command
+    await cmd_my_meals(ctx.mock_message)
+    
+    # Verify message was sent
+    ctx.mock_message.answer.assert_called_once()
 
-if __name__ == "__main__":
-    unittest.main() 
\ No newline at end of file
+
+async def test_delete_meal_command(ctx):
+    """Test the /delete_meal command."""
+    from src.bot import cmd_delete_meal
+    
+    # Set test input
+    ctx.mock_message.text = "/delete_meal 1"
+    
+    # Execute command
+    await cmd_delete_meal(ctx.mock_message)
+    
+    # Verify message was sent
+    ctx.mock_message.answer.assert_called_once()
@@ -0,0 +1,328 @@
+import pytest
+import asyncio
+import datetime
+from unittest.mock import AsyncMock, patch
+
+# The test environment is set up in conftest
+import src.metrics
+from src.config import ALMATY_TIMEZONE
+from src.metrics import (
+    count_metrics_in_range, get_metrics_report, get_order_totals, get_vendor_performance_metrics,
+    get_peak_hours_analysis, track_metric, start_metric_writer, stop_metric_writer
+)
+from src.models import (
+    Metric, MetricDailyRollup, MetricType, Vendor, VendorStatus, Consumer, Meal, Order, OrderStatus
+)
+from src.tasks import get_rollup_refresh_start
+
+
+# Seed data for the order and catalog aggregates: vendors as (telegram_id, name, status),
+# meals as (vendor index, Meal fields) and orders as (meal name, quantity, status)
+_NOW = datetime.datetime.now(ALMATY_TIMEZONE)
+_OPEN_WINDOW = dict(
+    pickup_start_time=_NOW + datetime.timedelta(hours=2),
+    pickup_end_time=_NOW + datetime.timedelta(hours=3),
+)
+_ENDED_WINDOW = dict(
+    pickup_start_time=_NOW - datetime.timedelta(hours=2),
+    pickup_end_time=_NOW - datetime.timedelta(hours=1),
+)
+_VENDORS = [
+    (1001, "Vendor A", VendorStatus.APPROVED),
+    (1002, "Vendor B", VendorStatus.APPROVED),
+    (1003, "Vendor C", VendorStatus.PENDING),
+]
+_MEAL_KWARGS = [
+    (0, dict(name="A1", price=1000, quantity=2, is_active=True, **_OPEN_WINDOW)),
+    # Sold out
+    (0, dict(name="A2", price=500, quantity=0, is_active=True, **_OPEN_WINDOW)),
+    # No longer listed
+    (0, dict(name="A3", price=2000, quantity=1, is_active=False, **_OPEN_WINDOW)),
+    # Pickup window over
+    (1, dict(name="B1", price=1500, quantity=1, is_active=True, **_ENDED_WINDOW)),
+    (2, dict(name="C1", price=800, quantity=1, is_active=True, **_OPEN_WINDOW)),
+]
+_ORDERS = [
+    ("A1", 2, OrderStatus.PAID),
+    ("A1", 1, OrderStatus.COMPLETED),
+    ("A1", 1, OrderStatus.PENDING),
+    ("A2", 1, OrderStatus.PAID),
+    ("B1", 3, OrderStatus.PAID),
+    ("B1", 1, OrderStatus.CANCELLED),
+    ("C1", 1, OrderStatus.PAID),
+]
+
+
+@pytest.fixture
+async def catalog():
+    """Vendors, meals and orders for the order and catalog aggregates"""
+    vendors = [
+        await Vendor.create(telegram_id=telegram_id, name=name, status=status)
+        for telegram_id, name, status in _VENDORS
+    ]
+    consumer = await Consumer.create(telegram_id=2001)
+    
+    meals = {}
+    for vendor_index, meal_kwargs in _MEAL_KWARGS:
+        meal = await Meal.create(
+            vendor=vendors[vendor_index],
+            description="Test meal",
+            location_address="Test Address",
+            **meal_kwargs
+        )
+        meals[meal.name] = meal
+    
+    await Order.bulk_create([
+        Order(consumer=consumer, meal=meals[meal_name], quantity=quantity, status=status)
+        for meal_name, quantity, status in _ORDERS
+    ])
+
+
+def day_start(day):
+    """Midnight in Almaty time at the start of a calendar day"""
+    return ALMATY_TIMEZONE.localize(datetime.datetime.combine(day, datetime.time.min))
+
+
+@pytest.fixture
+def days():
+    """The four calendar days before today, oldest first"""
+    today = datetime.datetime.now(ALMATY_TIMEZONE).date()
+    return [today - datetime.timedelta(days=n) for n in (4, 3, 2, 1)]
+
+
+async def test_count_metrics_in_range_with_missing_rollups(days):
+    """Test that days the rollup refresh hasn't reached are counted from the raw metrics"""
+    now = datetime.datetime.now(ALMATY_TIMEZONE)
+    hours = datetime.timedelta(hours=1)
+    
+    # (metric type, timestamp) of the tracked events
+    events = [
+        # Before the range starts
+        (MetricType.MEAL_VIEW, day_start(days[0]) + 9 * hours),
+        # Partial first day of the range
+        (MetricType.MEAL_VIEW, day_start(days[0]) + 15 * hours),
+        # Rolled-up day
+        (MetricType.MEAL_VIEW, day_start(days[1]) + 10 * hours),
+        (MetricType.MEAL_VIEW, day_start(days[1]) + 14 * hours),
+        # Newest rolled-up day, which may have been partial when it was rolled up
+        (MetricType.MEAL_VIEW, day_start(days[2]) + 12 * hours),
+        # Day without a rollup row, e.g. missed while the process was down
+        (MetricType.MEAL_VIEW, day_start(days[3]) + 12 * hours),
+        (MetricType.ORDER_PAID, day_start(days[3]) + 13 * hours),
+        # Today
+        (MetricType.MEAL_VIEW, now - datetime.timedelta(seconds=1)),
+    ]
+    await Metric.bulk_create([
+        Metric(metric_type=metric_type, timestamp=timestamp)
+        for metric_type, timestamp in events
+    ])
+    await MetricDailyRollup.create(date=days[1], metric_type=MetricType.MEAL_VIEW, count=2)
+    await MetricDailyRollup.create(date=days[2], metric_type=MetricType.MEAL_VIEW, count=1)
+    
+    counts = await count_metrics_in_range(day_start(days[0]) + 12 * hours, now)
+    
+    assert counts == {MetricType.MEAL_VIEW.value: 6, MetricType.ORDER_PAID.value: 1}
+    
+    # Filtering by type applies to both the rollups and the raw metrics
+    counts = await count_metrics_in_range(
+        day_start(days[0]) + 12 * hours, now, [MetricType.ORDER_PAID]
+    )
+    
+    assert counts == {MetricType.ORDER_PAID.value: 1}
+
+
+async def test_rollup_refresh_start(days):
+    """Test that the rollup refresh starts from the newest rolled-up day or the first metric"""
+    # Nothing to roll up
+    assert await get_rollup_refresh_start() is None
+    
+    # No rollups yet, every metric is counted
+    await Metric.create(
+        metric_type=MetricType.MEAL_VIEW,
+        timestamp=day_start(days[0]) + datetime.timedelta(hours=15)
+    )
+    assert await get_rollup_refresh_start() == day_start(days[0])
+    
+    # Rolled up before, the day before the newest rollup is recounted
+    await MetricDailyRollup.create(date=days[0], metric_type=MetricType.MEAL_VIEW, count=1)
+    await MetricDailyRollup.create(date=days[2], metric_type=MetricType.MEAL_VIEW, count=1)
+    assert await get_rollup_refresh_start() == day_start(days[1])
+
+
+async def test_metrics_report_daily_sales(days):
+    """Test that paid orders are counted per Almaty calendar day, with empty days filled in"""
+    hours = datetime.timedelta(hours=1)
+    start_date = day_start(days[0]) + 12 * hours
+    end_date = day_start(days[2]) + 12 * hours
+    
+    # (metric type, timestamp) of the tracked events
+    events = [
+        # Before the range starts
+        (MetricType.ORDER_PAID, day_start(days[0]) + 9 * hours),
+        (MetricType.ORDER_PAID, day_start(days[0]) + 15 * hours),
+        # Late in the evening, still the same Almaty day
+        (MetricType.ORDER_PAID, day_start(days[0]) + 23 * hours),
+        # Not a sale
+        (MetricType.ORDER_CREATED, day_start(days[1]) + 12 * hours),
+        (MetricType.ORDER_PAID, day_start(days[2]) + 11 * hours),
+        # After the range ends
+        (MetricType.ORDER_PAID, day_start(days[2]) + 13 * hours),
+    ]
+    await Metric.bulk_create([
+        Metric(metric_type=metric_type, timestamp=timestamp)
+        for metric_type, timestamp in events
+    ])
+    
+    report = await get_metrics_report(start_date=start_date, end_date=end_date)
+    
+    assert report["details"]["daily_sales"] == [
+        {"date": days[0].isoformat(), "orders": 2},
+        {"date": days[1].isoformat(), "orders": 0},
+        {"date": days[2].isoformat(), "orders": 1},
+    ]
+
+
+async def test_get_order_totals(catalog):
+    """Test that orders are counted and valued (quantity * meal price) per status"""
+    totals = await get_order_totals()
+    
+    assert totals == {
+        OrderStatus.PAID.value: (4, 2 * 1000 + 500 + 3 * 1500 + 800),
+        OrderStatus.COMPLETED.value: (1, 1000),
+        OrderStatus.PENDING.value: (1, 1000),
+        OrderStatus.CANCELLED.value: (1, 1500),
+    }
+
+
+async def test_vendor_performance_metrics(catalog):
+    """Test that approved vendors are ranked by paid revenue with their meal and order stats"""
+    performance = await get_vendor_performance_metrics()
+    
+    assert performance["vendor_performance"] == [
+        {
+            "vendor_id": 1002,
+            "vendor_name": "Vendor B",
+            "total_meals": 1,
+            "total_orders": 2,
+            "paid_orders": 1,
+            "total_revenue": 3 * 1500,
+            "avg_meal_price": 1500,
+            "orders_per_meal": 1,
+        },
+        {
+            "vendor_id": 1001,
+            "vendor_name": "Vendor A",
+            # Only listed meals count, with their average price
+            "total_meals": 2,
+            "total_orders": 4,
+            # Paid and completed orders
+            "paid_orders": 3,
+            "total_revenue": 2 * 1000 + 1000 + 500,
+            "avg_meal_price": 750,
+            "orders_per_meal": 1.5,
+        },
+    ]
+    assert performance["summary"] == {
+        "total_vendors": 2,
+        "total_revenue": 8000,
+        "avg_revenue_per_vendor": 4000,
+    }
+
+
+async def test_peak_hours_analysis(days):
+    """Test that the last 30 days' metrics are counted per Almaty hour of day and weekday"""
+    hours = datetime.timedelta(hours=1)
+    
+    # Events at 18:xx on two days and at 09:xx on one, plus one too old to count
+    timestamps = [
+        day_start(days[0]) + 18 * hours,
+        day_start(days[1]) + 18.5 * hours,
+        day_start(days[2]) + 9 * hours,
+        day_start(days[0]) - datetime.timedelta(days=40),
+    ]
+    await Metric.bulk_create([
+        Metric(metric_type=MetricType.MEAL_VIEW, timestamp=timestamp)
+        for timestamp in timestamps
+    ])
+    
+    analysis = await get_peak_hours_analysis()
+    
+    assert analysis["hourly_breakdown"] == {hour: {18: 2, 9: 1}.get(hour, 0) for hour in range(24)}
+    assert analysis["weekday_breakdown"] == {
+        weekday: sum(day.weekday() == weekday for day in days[:3]) for weekday in range(7)
+    }
+    assert analysis["peak_hours"][:2] == [(18, 2), (9, 1)]
+    assert analysis["total_activity"] == 3
+
+
+async def test_metrics_report_overview(catalog):
+    """Test the all-time overview counts and the engagement metrics derived from them"""
+    await Metric.bulk_create([Metric(metric_type=MetricType.USER_REGISTRATION) for _ in range(2)])
+    
+    report = await get_metrics_report()
+    
+    assert report["summary"]["overview"] == {
+        "total_users": 2,
+        "total_vendors": 3,
+        "approved_vendors": 2,
+        # Listed, in stock and still open for pickup: A1 and C1
+        "active_meals": 2,
+        "total_meals_ever": 5,
+        "paid_orders": 4,
+        "completed_orders": 1,
+        "gmv_total": 7800 + 1000,
+    }
+    assert report["summary"]["engagement"] == {
+        # Listed meals per approved vendor
+        "meals_per_vendor": 4 / 2,
+        "avg_order_value": 7800 / 4,
+        "total_sales_value": 7800,
+    }
+
+
+@pytest.fixture
+async def metric_writer():
+    """Run the background metric writer for one test"""
+    start_metric_writer()
+    yield
+    await stop_metric_writer()
+
+
+async def test_track_metric_without_writer():
+    """Test that metrics are saved immediately when the writer isn't running"""
+    metric = await track_metric(MetricType.MEAL_VIEW, entity_id=1)
+    
+    assert metric.id is not None
+    assert await Metric.filter(metric_type=MetricType.MEAL_VIEW).count() == 1
+
+
+async def test_metric_writer_flushes_on_stop(metric_writer):
+    """Test that queued metrics are written in bulk once the writer is stopped"""
+    metrics = [await track_metric(MetricType.MEAL_VIEW, entity_id=n) for n in range(5)]
+    
+    # Queued, not saved yet
+    assert all(metric.id is None for metric in metrics)
+    
+    await stop_metric_writer()
+    
+    entity_ids = await Metric.filter(metric_type=MetricType.MEAL_VIEW).values_list("entity_id", flat=True)
+    assert sorted(entity_ids) == list(range(5))
+
+
+async def test_track_metric_queue_full(metric_writer):
+    """Test that metrics are saved immediately when the writer's queue is full"""
+    with patch.object(src.metrics._metric_queue, "put_nowait", side_effect=asyncio.QueueFull):
+        metric = await track_metric(MetricType.MEAL_VIEW)
+    
+    assert metric.id is not None
+    assert await Metric.filter(metric_type=MetricType.MEAL_VIEW).count() == 1
+
+
+async def test_metric_writer_bulk_insert_failure(metric_writer):
+    """Test that a batch is written one metric at a time when the bulk insert fails"""
+    with patch.object(Metric, "bulk_create", AsyncMock(side_effect=Exception("Test error"))):
+        for _ in range(3):
+            await track_metric(MetricType.MEAL_VIEW)
+        await stop_metric_writer()
+    
+    assert await Metric.filter(metric_type=MetricType.MEAL_VIEW).count() == 3
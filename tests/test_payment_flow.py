@@ -1,56 +1,61 @@
+import asyncio
 import pytest
 import unittest.mock as mock
 from decimal import Decimal
 import os
-import pytest_asyncio
+import hmac
+import hashlib
 from unittest.mock import patch
 
 from src.models import Vendor, Consumer, Meal, Order, OrderStatus, VendorStatus
 from src.payment import PaymentGateway
+from tests.conftest import clear_test_tables
+
+# The webhook tests share one seeded order, reset before each test
+pytestmark = pytest.mark.shared_data
 
 # Set up environment variables for testing
-TEST_ENV = {
-    "PAYMENT_GATEWAY_API_KEY": "test_api_key",
-    "PAYMENT_GATEWAY_SECRET": "test_secret",
-    "PAYMENT_GATEWAY_URL": "https://test-payment.kz",
-    "PAYMENT_GATEWAY_ENABLED": "True",
-    "PAYMENT_WEBHOOK_SECRET": "webhook_secret"
-}
-
-@pytest.fixture(autouse=True)
+_TEST_ENV_ITEMS = (
+    ("PAYMENT_GATEWAY_API_KEY", "test_api_key"),
+    ("PAYMENT_GATEWAY_SECRET", "test_secret"),
+    ("PAYMENT_GATEWAY_URL", "https://test-payment.kz"),
+    ("PAYMENT_GATEWAY_ENABLED", "True"),
+    ("PAYMENT_WEBHOOK_SECRET", "webhook_secret"),
+)
+_TEST_ENV_KEYS = tuple(key for key, _ in _TEST_ENV_ITEMS)
+
+@pytest.fixture(autouse=True, scope="module")
 def setup_test_env():
-    """Set up test environment variables for payment gateway tests"""
-    original_values = {}
-    for key, value in TEST_ENV.items():
-        original_values[key] = os.environ.get(key)
-        os.environ[key] = value
+    """Set up test environment variables once for the payment gateway tests"""
+    original_values = {key: os.environ.get(key) for key in _TEST_ENV_KEYS}
+    os.environ.update(_TEST_ENV_ITEMS)
     
     yield
     
     # Restore original environment variables
     for key, value in original_values.items():
         if value is None:
-            if key in os.environ:
-                del os.environ[key]
+            os.environ.pop(key, None)
         else:
             os.environ[key] = value
 
 
-@pytest.mark.asyncio
-async def test_payment_gateway_init():
+@pytest.fixture(scope="module")
+def gateway(setup_test_env):
+    """Payment gateway built once with the test environment"""
+    return PaymentGateway()
+
+
+async def test_payment_gateway_init(gateway):
     """Test payment gateway initialization"""
-    gateway = PaymentGateway()
     assert gateway.enabled is not None
     assert gateway.api_key is not None
     assert gateway.base_url is not None
     assert gateway.secret is not None
 
 
-@pytest.mark.asyncio
-async def test_create_payment():
+async def test_create_payment(gateway):
     """Test creating a payment for an order"""
-    gateway = PaymentGateway()
-    
     order_id = 123
     amount = Decimal("100.00")
     description = "Test payment"
@@ -63,35 +68,60 @@ async def test_create_payment():
     assert gateway.base_url in payment_url
 
 
-@pytest.mark.asyncio
-async def test_verify_webhook_signature():
+async def test_verify_webhook_signature(gateway):
     """Test webhook signature verification"""
-    gateway = PaymentGateway()
+    # The test configuration enables the gateway with a webhook secret,
+    # so signatures are checked in test mode too
+    payload = '{"payment_id": "test123", "status": "completed"}'
+    signature = hmac.new(b"webhook_secret", payload.encode(), hashlib.sha256).hexdigest()
+    
+    assert gateway.verify_webhook_signature(payload, signature) is True
+    assert gateway.verify_webhook_signature(payload, "invalid_signature") is False
+
+
+async def test_verify_webhook_signature_with_secret():
+    """Test webhook signature verification against a configured secret"""
+    with patch("src.payment.PAYMENT_WEBHOOK_SECRET", "webhook_secret"), \
+         patch("src.payment.PAYMENT_GATEWAY_ENABLED", True):
+        gateway = PaymentGateway()
     
-    # In test mode, verification should always pass
     payload = '{"payment_id": "test123", "status": "completed"}'
-    signature = "invalid_signature"
+    signature = hmac.new(b"webhook_secret", payload.encode(), hashlib.sha256).hexdigest()
     
-    result = gateway.verify_webhook_signature(payload, signature)
-    assert result is True
+    # Both str and raw bytes payloads are accepted
+    assert gateway.verify_webhook_signature(payload, signature) is True
+    assert gateway.verify_webhook_signature(payload.encode(), signature) is True
+    assert gateway.verify_webhook_signature(payload, "invalid_signature") is False
+
+
+# Initial state of the seeded order, restored before each test
+ORIGINAL_PAYMENT_ID = "orig_payment_id"
+INITIAL_MEAL_QUANTITY = 5
+ORDER_QUANTITY = 2
 
 
-@pytest_asyncio.fixture
-async def test_order_data():
-    """Create test data for webhook processing tests"""
-    # Create required models
-    consumer = await Consumer.create(telegram_id=123456789)
-    vendor = await Vendor.create(
-        telegram_id=987654321,
-        name="Test Vendor",
-        status=VendorStatus.APPROVED
+@pytest.fixture(scope="module")
+async def seeded_order():
+    """Create the consumer, vendor, meal and order once for the module"""
+    # Start from an empty database, the per-test cleanup is skipped in this module
+    await clear_test_tables()
+    
+    # Create required models; the consumer and vendor don't depend on each
+    # other, so they are created together
+    consumer, vendor = await asyncio.gather(
+        Consumer.create(telegram_id=123456789),
+        Vendor.create(
+            telegram_id=987654321,
+            name="Test Vendor",
+            status=VendorStatus.APPROVED
+        )
     )
     meal = await Meal.create(
         vendor=vendor,
         name="Test Meal",
         description="A test meal",
         price=Decimal("100.00"),
-        quantity=5,
+        quantity=INITIAL_MEAL_QUANTITY,
         pickup_start_time="2025-06-01T12:00:00",
         pickup_end_time="2025-06-01T14:00:00",
         location_address="Test Address",
@@ -103,8 +133,8 @@ async def test_order_data():
         consumer=consumer,
         meal=meal,
         status=OrderStatus.PENDING,
-        payment_id="orig_payment_id",
-        quantity=2
+        payment_id=ORIGINAL_PAYMENT_ID,
+        quantity=ORDER_QUANTITY
     )
     
     return {
@@ -115,8 +145,28 @@ async def test_order_data():
     }
 
 
-@pytest.mark.asyncio
-async def test_process_webhook(test_order_data):
+@pytest.fixture
+async def test_order_data(seeded_order):
+    """Reset the seeded order and meal fields the webhook tests change"""
+    order = seeded_order["order"]
+    meal = seeded_order["meal"]
+    
+    await Order.filter(id=order.id).update(
+        status=OrderStatus.PENDING,
+        payment_id=ORIGINAL_PAYMENT_ID,
+        quantity=ORDER_QUANTITY
+    )
+    await Meal.filter(id=meal.id).update(quantity=INITIAL_MEAL_QUANTITY)
+    
+    order.status = OrderStatus.PENDING
+    order.payment_id = ORIGINAL_PAYMENT_ID
+    order.quantity = ORDER_QUANTITY
+    meal.quantity = INITIAL_MEAL_QUANTITY
+    
+    return seeded_order
+
+
+async def test_process_webhook(gateway, test_order_data):
     """Test processing a webhook notification"""
     order = test_order_data["order"]
     
@@ -128,31 +178,91 @@ async def test_process_webhook(test_order_data):
         "timestamp": "2025-06-01T13:00:00"
     }
     
-    # Disable actual notifications
-    with patch("src.payment.payment_gateway.send_order_notifications", return_value=None):
-        # Process webhook
-        gateway = PaymentGateway()
-        result = await gateway.process_webhook(webhook_data)
-        
-        # Verify result
-        assert result is True
-        
-        # Refresh order from database
-        updated_order = await Order.get(id=order.id)
-        assert updated_order.status == OrderStatus.PAID
-        assert updated_order.payment_id == "test_payment_id"
-        
-        # Refresh meal from database
-        meal = test_order_data["meal"]
-        updated_meal = await Meal.get(id=meal.id)
-        assert updated_meal.quantity == 3  # 5 initial - 2 ordered
-
-
-@pytest.mark.asyncio
-async def test_process_webhook_invalid_order():
-    """Test processing a webhook with an invalid order ID"""
-    gateway = PaymentGateway()
+    # Process webhook, it only updates the database and sends no notifications
+    result = await gateway.process_webhook(webhook_data)
+    
+    # Verify result
+    assert result is True
+    
+    # Refresh order from database
+    updated_order = await Order.get(id=order.id)
+    assert updated_order.status == OrderStatus.PAID
+    assert updated_order.payment_id == "test_payment_id"
+    
+    # Refresh meal from database
+    meal = test_order_data["meal"]
+    updated_meal = await Meal.get(id=meal.id)
+    assert updated_meal.quantity == 3  # 5 initial - 2 ordered
+
+
+async def test_process_webhook_is_idempotent(gateway, test_order_data):
+    """Test that a redelivered webhook doesn't decrement stock twice"""
+    order = test_order_data["order"]
+    meal = test_order_data["meal"]
+    
+    webhook_data = {
+        "payment_id": "test_payment_id",
+        "status": "completed",
+        "order_id": order.id,
+        "timestamp": "2025-06-01T13:00:00"
+    }
+    
+    assert await gateway.process_webhook(webhook_data) is True
+    assert await gateway.process_webhook(webhook_data) is True
+    
+    updated_meal = await Meal.get(id=meal.id)
+    assert updated_meal.quantity == 3  # 5 initial - 2 ordered, applied once
+
+
+@pytest.mark.parametrize("status", [OrderStatus.COMPLETED, OrderStatus.CANCELLED])
+async def test_process_webhook_ignores_settled_orders(gateway, test_order_data, status):
+    """Test that a late webhook doesn't re-pay an order that is no longer pending"""
+    order = test_order_data["order"]
+    meal = test_order_data["meal"]
+    await Order.filter(id=order.id).update(status=status)
+    
+    webhook_data = {
+        "payment_id": "late_payment_id",
+        "status": "completed",
+        "order_id": order.id,
+        "timestamp": "2025-06-01T13:00:00"
+    }
+    
+    assert await gateway.process_webhook(webhook_data) is True
+    
+    updated_order = await Order.get(id=order.id)
+    assert updated_order.status == status
+    assert updated_order.payment_id == ORIGINAL_PAYMENT_ID
+    
+    updated_meal = await Meal.get(id=meal.id)
+    assert updated_meal.quantity == INITIAL_MEAL_QUANTITY  # Stock untouched
+
+
+async def test_process_webhook_does_not_oversell(gateway, test_order_data):
+    """Test that meal quantity never drops below zero"""
+    order = test_order_data["order"]
+    meal = test_order_data["meal"]
+    
+    # Order more portions than are left in stock
+    order.quantity = 7
+    await order.save()
+    
+    webhook_data = {
+        "payment_id": "test_payment_id",
+        "status": "completed",
+        "order_id": order.id,
+        "timestamp": "2025-06-01T13:00:00"
+    }
     
+    result = await gateway.process_webhook(webhook_data)
+    assert result is True
+    
+    updated_meal = await Meal.get(id=meal.id)
+    assert updated_meal.quantity == 0
+
+
+async def test_process_webhook_invalid_order(gateway):
+    """Test processing a webhook with an invalid order ID"""
     # Invalid order ID
     webhook_data = {
         "payment_id": "test_payment_id",
@@ -166,60 +276,20 @@ async def test_process_webhook_invalid_order():
     assert result is False
 
 
-@pytest_asyncio.fixture
-async def test_order_data_non_completed():
-    """Create test data for non-completed webhook tests"""
-    consumer = await Consumer.create(telegram_id=123456790)
-    vendor = await Vendor.create(
-        telegram_id=987654320,
-        name="Test Vendor 2",
-        status=VendorStatus.APPROVED
-    )
-    meal = await Meal.create(
-        vendor=vendor,
-        name="Test Meal 2",
-        description="Another test meal",
-        price=Decimal("150.00"),
-        quantity=3,
-        pickup_start_time="2025-06-01T12:00:00",
-        pickup_end_time="2025-06-01T14:00:00",
-        location_address="Test Address 2",
-        location_latitude=43.238949,
-        location_longitude=76.889709,
-        is_active=True
-    )
-    order = await Order.create(
-        consumer=consumer,
-        meal=meal,
-        status=OrderStatus.PENDING,
-        payment_id="orig_payment_id_2",
-        quantity=1
-    )
-    
-    return {
-        "consumer": consumer,
-        "vendor": vendor,
-        "meal": meal,
-        "order": order
-    }
-
-
-@pytest.mark.asyncio
-async def test_process_webhook_non_completed_status(test_order_data_non_completed):
+async def test_process_webhook_non_completed_status(gateway, test_order_data):
     """Test processing a webhook with a non-completed status"""
-    order = test_order_data_non_completed["order"]
-    meal = test_order_data_non_completed["meal"]
+    order = test_order_data["order"]
+    meal = test_order_data["meal"]
     
     # Create webhook data with non-completed status
     webhook_data = {
-        "payment_id": "test_payment_id_2",
+        "payment_id": "test_payment_id",
         "status": "failed",  # Non-completed status
         "order_id": order.id,
         "timestamp": "2025-06-01T13:00:00"
     }
     
     # Process webhook
-    gateway = PaymentGateway()
     result = await gateway.process_webhook(webhook_data)
     
     # Verify result (should be true since processing succeeded, even though order wasn't updated)
@@ -228,8 +298,8 @@ async def test_process_webhook_non_completed_status(test_order_data_non_complete
     # Refresh order from database
     updated_order = await Order.get(id=order.id)
     assert updated_order.status == OrderStatus.PENDING
-    assert updated_order.payment_id == "orig_payment_id_2"
+    assert updated_order.payment_id == ORIGINAL_PAYMENT_ID
     
     # Refresh meal from database
     updated_meal = await Meal.get(id=meal.id)
-    assert updated_meal.quantity == 3  # Still 3 
\ No newline at end of file
+    assert updated_meal.quantity == INITIAL_MEAL_QUANTITY  # Unchanged 
\ No newline at end of file
@@ -0,0 +1,232 @@
+import pytest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+from aiogram.types import ContentType
+
+# The test environment is set up in conftest
+from src.security import RateLimiter, contains_spam, rate_limit, webhook_security_middleware
+from tests.conftest import TEST_CONSUMER_ID
+
+
+@pytest.fixture
+def limiter():
+    """A rate limiter with no recorded requests"""
+    return RateLimiter()
+
+
+@pytest.fixture
+def clock():
+    """The rate limiter's time.time(), set through its return_value"""
+    with patch("src.security.time") as mock_time:
+        mock_time.time.return_value = 1_700_000_000.0
+        yield mock_time.time
+
+
+@pytest.fixture
+def global_limiter(limiter):
+    """The fresh rate limiter, installed as the one the middleware and decorator use"""
+    with patch("src.security.rate_limiter", limiter):
+        yield limiter
+
+
+def make_webhook_request(content_length=100):
+    """A POST request from a fixed client IP declaring the given body size"""
+    request = make_mocked_request(
+        "POST", "/payment-webhook", headers={"Content-Length": str(content_length)}
+    )
+    return request.clone(remote="10.0.0.1")
+
+
+def test_rate_limit_window(limiter, clock):
+    """Test that the (limit+1)th request in a period is rejected until the period has passed"""
+    for _ in range(3):
+        assert not limiter.is_rate_limited(1, limit=3, period=60)
+    assert limiter.is_rate_limited(1, limit=3, period=60)
+    
+    # The first requests are still inside the window
+    clock.return_value += 59
+    assert limiter.is_rate_limited(1, limit=3, period=60)
+    
+    # The first four requests have left the window, only the last two count
+    clock.return_value += 1
+    assert not limiter.is_rate_limited(1, limit=3, period=60)
+    
+    # Other users have their own window
+    assert not limiter.is_rate_limited(2, limit=3, period=60)
+
+
+# (message text, expected to be flagged as spam)
+SPAM_CASES = [
+    (None, False),
+    ("", False),
+    ("Хочу заказать два обеда, спасибо!", False),
+    # Up to three links are fine
+    ("https://a.kz https://b.kz https://c.kz", False),
+    ("https://a.kz http://b.kz https://c.kz http://d.kz", True),
+    # Five or more repeats of the same character or chunk
+    ("Скидкааааа", True),
+    ("buy buy buy buy buy now", True),
+    ("x" * 1001, True),
+]
+
+
+@pytest.mark.parametrize("text, is_spam", SPAM_CASES)
+def test_contains_spam(text, is_spam):
+    """Test that URL-heavy, repetitive and very long messages are flagged as spam"""
+    assert contains_spam(text) is is_spam
+
+
+def test_cleanup_drops_only_idle_entries(limiter, clock):
+    """Test that cleanup keeps users and IPs with a request in the last hour"""
+    limiter.is_rate_limited(1)
+    limiter.is_rate_limited(2)
+    limiter.track_ip("10.0.0.1")
+    limiter.track_ip("10.0.0.2")
+    
+    # User 1 and the first IP come back later, the others stay idle
+    clock.return_value += 3000
+    limiter.is_rate_limited(1)
+    limiter.track_ip("10.0.0.1")
+    
+    clock.return_value += 601
+    limiter._cleanup_old_data()
+    
+    assert list(limiter.user_requests) == [1]
+    assert list(limiter.ip_requests) == ["10.0.0.1"]
+
+
+async def test_webhook_middleware_passes_requests(global_limiter):
+    """Test that ordinary requests reach the handler and are tracked"""
+    handler = AsyncMock(return_value=web.Response())
+    
+    response = await webhook_security_middleware(make_webhook_request(), handler)
+    
+    assert response.status == 200
+    handler.assert_awaited_once()
+    assert len(global_limiter.ip_requests["10.0.0.1"]) == 1
+
+
+async def test_webhook_middleware_rejects_oversized_payload(global_limiter):
+    """Test that oversized payloads get 413 before the IP is recorded"""
+    handler = AsyncMock(return_value=web.Response())
+    
+    response = await webhook_security_middleware(make_webhook_request(2 * 1024 * 1024), handler)
+    
+    assert response.status == 413
+    handler.assert_not_awaited()
+    assert "10.0.0.1" not in global_limiter.ip_requests
+
+
+async def test_webhook_middleware_rate_limits_ip(global_limiter):
+    """Test that an IP over its request limit gets 429"""
+    handler = AsyncMock(return_value=web.Response())
+    for _ in range(30):
+        global_limiter.track_ip("10.0.0.1")
+    
+    response = await webhook_security_middleware(make_webhook_request(), handler)
+    
+    assert response.status == 429
+    handler.assert_not_awaited()
+
+
+def test_repeated_abuse_bans_user(limiter, clock):
+    """Test that a user who keeps hitting the limit is banned, even once the window has passed"""
+    assert not limiter.is_rate_limited(1, limit=1, period=60)
+    
+    # The sixth rejected request bans the user
+    for _ in range(6):
+        assert limiter.is_rate_limited(1, limit=1, period=60)
+    
+    assert isinstance(limiter.banned_users, frozenset)
+    assert limiter.banned_users == {1}
+    
+    clock.return_value += 3600
+    assert limiter.is_rate_limited(1, limit=1, period=60)
+    assert not limiter.is_rate_limited(2, limit=1, period=60)
+
+
+async def test_rate_limit_tracks_commands(global_limiter, message):
+    """Test that text commands are counted and passed on to the handler"""
+    handler = AsyncMock()
+    message.content_type = ContentType.TEXT
+    message.text = "/start now"
+    
+    await rate_limit(key="test")(handler)(message)
+    
+    handler.assert_awaited_once_with(message)
+    assert global_limiter.command_usage[TEST_CONSUMER_ID]["/start"] == 1
+
+
+async def test_rate_limit_blocks_spam(global_limiter, message):
+    """Test that spam text messages are answered and not passed on"""
+    handler = AsyncMock()
+    message.content_type = ContentType.TEXT
+    message.text = "https://a.kz https://b.kz https://c.kz https://d.kz"
+    
+    await rate_limit(key="test")(handler)(message)
+    
+    handler.assert_not_awaited()
+    message.answer.assert_awaited_once()
+
+
+async def test_rate_limit_skips_text_checks_for_other_content(global_limiter, message):
+    """Test that only text messages are checked for commands and spam"""
+    handler = AsyncMock()
+    message.content_type = ContentType.PHOTO
+    message.text = "https://a.kz https://b.kz https://c.kz https://d.kz"
+    
+    await rate_limit(key="test")(handler)(message)
+    
+    handler.assert_awaited_once_with(message)
+    assert not global_limiter.command_usage
+
+
+async def test_rate_limit_answers_limited_requests(global_limiter, message):
+    """Test that rate-limited messages and callback queries get the rate limit answer"""
+    handler = AsyncMock()
+    message.content_type = ContentType.TEXT
+    message.text = "Привет"
+    wrapped = rate_limit(limit=1, period=60, key="test")(handler)
+    
+    await wrapped(message)
+    await wrapped(message)
+    
+    handler.assert_awaited_once()
+    message.answer.assert_awaited_once()
+    
+    # Callback queries have no content type and answer through their message
+    callback_query = SimpleNamespace(from_user=message.from_user, message=AsyncMock())
+    await wrapped(callback_query)
+    
+    handler.assert_awaited_once()
+    callback_query.message.answer.assert_awaited_once()
+
+
+def test_track_command_counts_and_resets(limiter, clock):
+    """Test that command usage is counted per user and reset after a day"""
+    for _ in range(3):
+        limiter.track_command(1, "/start")
+    limiter.track_command(1, "/help")
+    
+    assert limiter.command_usage[1] == {"/start": 3, "/help": 1}
+    
+    # Counting starts over a day after the first command
+    clock.return_value += 86401
+    limiter.track_command(1, "/start")
+    
+    assert limiter.command_usage[1] == {"/start": 1}
+    
+    # Unusually heavy use of one command is flagged as suspicious
+    for _ in range(50):
+        limiter.track_command(1, "/start")
+    
+    assert limiter.suspicious_activity[1] == 1
+    
+    # Cleanup drops the counts once their day is over
+    clock.return_value += 86401
+    limiter._cleanup_old_data()
+    
+    assert 1 not in limiter.command_usage
+    assert 1 not in limiter.command_reset
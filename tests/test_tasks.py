@@ -0,0 +1,112 @@
+import pytest
+import datetime
+from unittest.mock import patch
+
+# The test environment is set up in conftest
+from src.config import ALMATY_TIMEZONE
+from src.models import Vendor, VendorStatus, Meal, Consumer, Order, OrderStatus
+from src.tasks import deactivate_expired_meals, cleanup_expired_orders
+
+
+# Seed data built once per worker process: the Meal fields of each test meal
+_NOW = datetime.datetime.now(ALMATY_TIMEZONE)
+_MEAL_KWARGS = [
+    dict(
+        name="Expired Meal",
+        pickup_start_time=_NOW - datetime.timedelta(hours=2),
+        pickup_end_time=_NOW - datetime.timedelta(hours=1),
+        is_active=True,
+    ),
+    dict(
+        name="Live Meal",
+        pickup_start_time=_NOW + datetime.timedelta(hours=1),
+        pickup_end_time=_NOW + datetime.timedelta(hours=2),
+        is_active=True,
+    ),
+    # Already delisted, its pickup window is still open
+    dict(
+        name="Delisted Meal",
+        pickup_start_time=_NOW + datetime.timedelta(hours=1),
+        pickup_end_time=_NOW + datetime.timedelta(hours=2),
+        is_active=False,
+    ),
+]
+
+
+@pytest.fixture
+async def meals():
+    """A vendor's meals, by name"""
+    vendor = await Vendor.create(telegram_id=1001, name="Test Vendor", status=VendorStatus.APPROVED)
+    
+    meals = {}
+    for meal_kwargs in _MEAL_KWARGS:
+        meal = await Meal.create(
+            vendor=vendor,
+            description="Test meal",
+            price=1000,
+            quantity=2,
+            location_address="Test Address",
+            **meal_kwargs
+        )
+        meals[meal.name] = meal
+    return meals
+
+
+async def test_deactivate_expired_meals(meals):
+    """Test that only active meals past their pickup window are deactivated"""
+    with patch.object(Meal, "filter", wraps=Meal.filter) as meal_filter:
+        await deactivate_expired_meals()
+    
+    # Selected and updated with one filtered statement
+    meal_filter.assert_called_once()
+    
+    active = dict(await Meal.all().values_list("name", "is_active"))
+    assert active == {
+        "Expired Meal": False,
+        "Live Meal": True,
+        "Delisted Meal": False,
+    }
+
+
+class _PayAfterSelect:
+    """Wraps the expired order select, paying an order once the select has run"""
+    
+    def __init__(self, queryset, order_id):
+        self.queryset = queryset
+        self.order_id = order_id
+    
+    async def values_list(self, *args, **kwargs):
+        order_ids = await self.queryset.values_list(*args, **kwargs)
+        await Order.filter(id=self.order_id).update(status=OrderStatus.PAID)
+        return order_ids
+
+
+async def test_cleanup_expired_orders(meals):
+    """Test that stale pending orders are cancelled, unless they were paid in the meantime"""
+    consumer = await Consumer.create(telegram_id=2001)
+    meal = meals["Live Meal"]
+    stale, paid_meanwhile, fresh = [
+        await Order.create(consumer=consumer, meal=meal, status=OrderStatus.PENDING)
+        for _ in range(3)
+    ]
+    await Order.filter(id__in=[stale.id, paid_meanwhile.id]).update(
+        created_at=_NOW - datetime.timedelta(minutes=31)
+    )
+    
+    filter_orders = Order.filter
+    
+    def filter_and_pay(*args, **kwargs):
+        queryset = filter_orders(*args, **kwargs)
+        if "created_at__lt" in kwargs:
+            return _PayAfterSelect(queryset, paid_meanwhile.id)
+        return queryset
+    
+    with patch.object(Order, "filter", side_effect=filter_and_pay):
+        await cleanup_expired_orders()
+    
+    statuses = dict(await Order.all().values_list("id", "status"))
+    assert statuses == {
+        stale.id: OrderStatus.CANCELLED,
+        paid_meanwhile.id: OrderStatus.PAID,
+        fresh.id: OrderStatus.PENDING,
+    }
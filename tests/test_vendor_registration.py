@@ -1,20 +1,11 @@
-import unittest
-import asyncio
+import pytest
 import os
+import re
 import sys
-from unittest.mock import MagicMock, patch, AsyncMock
+from types import SimpleNamespace
+from unittest.mock import MagicMock, AsyncMock
 
-# Add the parent directory to sys.path to import the src modules
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-
-# Set test environment variables
-os.environ["BOT_TOKEN"] = "TEST_BOT_TOKEN"
-os.environ["DB_HOST"] = "localhost"
-os.environ["DB_PORT"] = "5432"
-os.environ["DB_NAME"] = "asbolsyn_test"
-os.environ["DB_USER"] = "postgres"
-os.environ["DB_PASSWORD"] = "password"
-os.environ["ADMIN_CHAT_ID"] = "123456789"
+# Test environment variables are set once in conftest
 
 # Mock classes for FSM
 class MockState:
@@ -40,9 +31,13 @@ class MockVendor:
     contact_phone = MagicMock()
     status = MagicMock()
     
+    # Registered vendors by Telegram ID, seeded by the tests that need one
+    _STORE = {}
+    
     @classmethod
     async def filter(cls, **kwargs):
-        return []
+        vendor = cls._STORE.get(kwargs.get('telegram_id'))
+        return [vendor] if vendor else []
     
     @classmethod
     async def create(cls, **kwargs):
@@ -54,18 +49,8 @@ class MockVendor:
         mock_vendor.save = AsyncMock()
         return mock_vendor
 
-# Mock the imports
-sys.modules['src.models'] = MagicMock()
-sys.modules['src.models'].Vendor = MockVendor
-sys.modules['src.models'].VendorStatus = MockVendorStatus
-
-sys.modules['aiogram.fsm.state'] = MagicMock()
-sys.modules['aiogram.fsm.state'].State = MagicMock(side_effect=MockState)
-sys.modules['aiogram.fsm.state'].StatesGroup = MagicMock(side_effect=MockStatesGroup)
-
-# Mock the src.bot module to avoid importing the real one
-sys.modules['src.bot'] = MagicMock()
-sys.modules['src.bot'].VendorRegistration = MockStatesGroup()
+# "/approve_vendor <telegram id>" command, compiled once for the mock handler
+APPROVE_VENDOR_PATTERN = re.compile(r"^/approve_vendor\s+(\d+)$")
 
 # Create test handler functions to simulate the real ones
 async def mock_cmd_register_vendor(message, state):
@@ -120,180 +105,170 @@ async def mock_cmd_approve_vendor(message):
         return
     
     # Parse vendor ID
-    parts = message.text.split()
-    if len(parts) != 2:
+    match = APPROVE_VENDOR_PATTERN.match(message.text)
+    if not match:
         await message.answer("Wrong format")
         return
     
-    try:
-        vendor_id = int(parts[1])
-        vendors = await MockVendor.filter(telegram_id=vendor_id)
-        
-        if not vendors:
-            await message.answer("Vendor not found")
-            return
-        
-        vendor = vendors[0]
-        vendor.status = MockVendorStatus.APPROVED
-        await vendor.save()
-        
-        # Notify admin
-        await message.answer(f"Vendor approved: {vendor.name}")
-        
-        # Notify vendor
-        from src.bot import bot
-        await bot.send_message(
-            chat_id=vendor_id,
-            text="Your vendor application has been approved"
-        )
+    # The pattern only matches digits, so the ID always parses
+    vendor_id = int(match.group(1))
+    vendors = await MockVendor.filter(telegram_id=vendor_id)
+    
+    if not vendors:
+        await message.answer("Vendor not found")
+        return
+    
+    vendor = vendors[0]
+    vendor.status = MockVendorStatus.APPROVED
+    await vendor.save()
+    
+    # Notify admin
+    await message.answer(f"Vendor approved: {vendor.name}")
+    
+    # Notify vendor
+    from src.bot import bot
+    await bot.send_message(
+        chat_id=vendor_id,
+        text="Your vendor application has been approved"
+    )
+
+# Mock implementations served under the real src.bot names
+MOCK_BOT_ATTRIBUTES = {
+    "VendorRegistration": MockStatesGroup(),
+    "cmd_register_vendor": mock_cmd_register_vendor,
+    "process_vendor_name": mock_process_vendor_name,
+    "process_vendor_phone": mock_process_vendor_phone,
+    "cmd_approve_vendor": mock_cmd_approve_vendor,
+}
+
+@pytest.fixture(autouse=True, scope="module")
+def mock_bot_module():
+    """Serve the mock handlers and a mock bot as src.bot while this module's tests run.
     
-    except (ValueError, TypeError):
-        await message.answer("Invalid ID")
+    The patch is undone after the module, so the other test modules keep
+    the real src.bot and src.models.
+    """
+    mock_bot = MagicMock()
+    for name, value in MOCK_BOT_ATTRIBUTES.items():
+        setattr(mock_bot, name, value)
+    mock_bot.bot = MagicMock()
+    mock_bot.bot.send_message = AsyncMock()
+    
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setitem(sys.modules, "src.bot", mock_bot)
+        yield mock_bot
+
+# Tests for vendor registration process
 
-# Replace the module functions with our mock implementations
-sys.modules['src.bot'].cmd_register_vendor = mock_cmd_register_vendor
-sys.modules['src.bot'].process_vendor_name = mock_process_vendor_name
-sys.modules['src.bot'].process_vendor_phone = mock_process_vendor_phone
-sys.modules['src.bot'].cmd_approve_vendor = mock_cmd_approve_vendor
+def async_return(value):
+    """Build a plain coroutine function returning value, for stubs whose calls aren't asserted."""
+    async def _return(*args, **kwargs):
+        return value
+    return _return
 
-# Add bot mock
-sys.modules['src.bot'].bot = MagicMock()
-sys.modules['src.bot'].bot.send_message = AsyncMock()
 
-class TestVendorRegistration(unittest.TestCase):
-    """Tests for vendor registration process."""
+@pytest.fixture
+def mock_state():
+    """Mock FSM context holding the entered vendor name."""
+    mock_state = AsyncMock()
+    mock_state.get_data = async_return({"name": "Test Vendor"})
+    return mock_state
 
-    def setUp(self):
-        """Set up test environment."""
-        # Mock FSM context
-        self.mock_state = AsyncMock()
-        self.mock_state.set_state = AsyncMock()
-        self.mock_state.update_data = AsyncMock()
-        self.mock_state.get_data = AsyncMock(return_value={"name": "Test Vendor"})
-        self.mock_state.clear = AsyncMock()
-        
-        # Mock message
-        self.mock_message = AsyncMock()
-        self.mock_message.from_user = AsyncMock()
-        self.mock_message.from_user.id = 12345
-        self.mock_message.answer = AsyncMock()
-        self.mock_message.text = "Test Vendor"
-        
-        # Reset the send_message mock before each test
-        from src.bot import bot
-        bot.send_message.reset_mock()
 
-    def test_vendor_registration_flow(self):
-        """Test the vendor registration flow."""
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        try:
-            # Test registration command
-            loop.run_until_complete(self._test_register_vendor())
-            
-            # Test handling vendor name
-            loop.run_until_complete(self._test_process_vendor_name())
-            
-            # Test handling vendor phone
-            loop.run_until_complete(self._test_process_vendor_phone())
-            
-            # Test vendor approval
-            loop.run_until_complete(self._test_approve_vendor())
-        finally:
-            loop.close()
+@pytest.fixture
+def mock_message():
+    """Mock message from the registering vendor."""
+    mock_message = AsyncMock()
+    mock_message.from_user = SimpleNamespace(id=12345)
+    mock_message.text = "Test Vendor"
+    return mock_message
 
-    async def _test_register_vendor(self):
-        """Test the /register_vendor command."""
-        from src.bot import cmd_register_vendor
-        
-        # Reset the mock before test
-        self.mock_state.set_state.reset_mock()
-        self.mock_message.answer.reset_mock()
-        
-        # Execute the command handler
-        await cmd_register_vendor(self.mock_message, self.mock_state)
-        
-        # Verify state was set
-        self.mock_state.set_state.assert_called_once()
-        # Verify response was sent
-        self.mock_message.answer.assert_called_once()
 
-    async def _test_process_vendor_name(self):
-        """Test the handler for vendor name input."""
-        from src.bot import process_vendor_name
-        
-        # Reset the mock before test
-        self.mock_state.set_state.reset_mock()
-        self.mock_state.update_data.reset_mock()
-        self.mock_message.answer.reset_mock()
-        
-        # Execute the handler
-        await process_vendor_name(self.mock_message, self.mock_state)
-        
-        # Verify data was updated
-        self.mock_state.update_data.assert_called_once_with(name="Test Vendor")
-        # Verify state was changed
-        self.mock_state.set_state.assert_called_once()
-        # Verify response was sent
-        self.mock_message.answer.assert_called_once()
+@pytest.fixture(autouse=True)
+def reset_bot_mock():
+    """Reset the send_message mock before each test."""
+    from src.bot import bot
+    bot.send_message.reset_mock()
 
-    async def _test_process_vendor_phone(self):
-        """Test the handler for vendor phone input."""
-        from src.bot import process_vendor_phone
-        
-        # Reset the mock before test
-        self.mock_state.clear.reset_mock()
-        self.mock_message.answer.reset_mock()
-        
-        # Set test phone number
-        self.mock_message.text = "+77771234567"
-        
-        # Execute the handler
-        await process_vendor_phone(self.mock_message, self.mock_state)
-        
-        # Verify state was cleared
-        self.mock_state.clear.assert_called_once()
-        # Verify response was sent to vendor
-        self.mock_message.answer.assert_called_once()
-        # Verify notification was sent to admin
-        from src.bot import bot
-        bot.send_message.assert_called_once()
 
-    async def _test_approve_vendor(self):
-        """Test the admin approval of a vendor."""
-        from src.bot import cmd_approve_vendor
-        from src.bot import bot
-        
-        # Reset mocks
-        bot.send_message.reset_mock()
-        
-        # Mock an admin message
-        admin_message = AsyncMock()
-        admin_message.from_user = AsyncMock()
-        admin_message.from_user.id = int(os.environ["ADMIN_CHAT_ID"])
-        admin_message.text = "/approve_vendor 12345"
-        admin_message.answer = AsyncMock()
-        
-        # Patch MockVendor.filter to return a vendor
-        mock_vendor = AsyncMock()
-        mock_vendor.telegram_id = 12345
-        mock_vendor.name = "Test Vendor"
-        mock_vendor.save = AsyncMock()
-        
-        with patch.object(MockVendor, 'filter', return_value=[mock_vendor]):
-            # Execute the handler
-            await cmd_approve_vendor(admin_message)
-            
-            # Verify vendor status was updated
-            self.assertEqual(mock_vendor.status, MockVendorStatus.APPROVED)
-            # Verify vendor was saved
-            mock_vendor.save.assert_called_once()
-            # Verify response was sent to admin
-            admin_message.answer.assert_called_once()
-            # Verify notification was sent to vendor
-            bot.send_message.assert_called_once()
+async def test_register_vendor(mock_message, mock_state):
+    """Test the /register_vendor command."""
+    from src.bot import cmd_register_vendor
+    
+    # Execute the command handler
+    await cmd_register_vendor(mock_message, mock_state)
+    
+    # Verify state was set
+    mock_state.set_state.assert_called_once()
+    # Verify response was sent
+    mock_message.answer.assert_called_once()
+
+
+async def test_process_vendor_name(mock_message, mock_state):
+    """Test the handler for vendor name input."""
+    from src.bot import process_vendor_name
+    
+    # Execute the handler
+    await process_vendor_name(mock_message, mock_state)
+    
+    # Verify data was updated
+    mock_state.update_data.assert_called_once_with(name="Test Vendor")
+    # Verify state was changed
+    mock_state.set_state.assert_called_once()
+    # Verify response was sent
+    mock_message.answer.assert_called_once()
+
+
+async def test_process_vendor_phone(mock_message, mock_state):
+    """Test the handler for vendor phone input."""
+    from src.bot import process_vendor_phone
+    
+    # Set test phone number
+    mock_message.text = "+77771234567"
+    
+    # Execute the handler
+    await process_vendor_phone(mock_message, mock_state)
+    
+    # Verify state was cleared
+    mock_state.clear.assert_called_once()
+    # Verify response was sent to vendor
+    mock_message.answer.assert_called_once()
+    # Verify notification was sent to admin
+    from src.bot import bot
+    bot.send_message.assert_called_once()
+
+
+@pytest.fixture
+def seeded_vendor():
+    """Register a pending vendor in the mock vendor store."""
+    vendor = MockVendor()
+    vendor.telegram_id = 12345
+    vendor.name = "Test Vendor"
+    vendor.status = MockVendorStatus.PENDING
+    vendor.save = AsyncMock()
+    MockVendor._STORE[vendor.telegram_id] = vendor
+    yield vendor
+    MockVendor._STORE.clear()
 
 
-if __name__ == "__main__":
-    unittest.main() 
\ No newline at end of file
+async def test_approve_vendor(seeded_vendor):
+    """Test the admin approval of a vendor."""
+    from src.bot import cmd_approve_vendor
+    from src.bot import bot
+    
+    # Mock an admin message
+    admin_message = AsyncMock()
+    admin_message.from_user = SimpleNamespace(id=int(os.environ["ADMIN_CHAT_ID"]))
+    admin_message.text = "/approve_vendor 12345"
+    
+    # Execute the handler
+    await cmd_approve_vendor(admin_message)
+    
+    # Verify vendor status was updated
+    assert seeded_vendor.status == MockVendorStatus.APPROVED
+    # Verify vendor was saved
+    seeded_vendor.save.assert_called_once()
+    # Verify response was sent to admin
+    admin_message.answer.assert_called_once()
+    # Verify notification was sent to vendor
+    bot.send_message.assert_called_once()
@@ -1,14 +1,19 @@
 import pytest
+import asyncio
+import contextlib
+import json
 import os
+import hmac
+import hashlib
 from unittest.mock import AsyncMock, patch, MagicMock
 from aiohttp import web
-from aiohttp.test_utils import TestClient, TestServer
+from aiohttp.test_utils import TestClient, TestServer, make_mocked_request
 
 from src.config import (
     WEBHOOK_PATH, WEBHOOK_URL, WEBAPP_HOST, WEBAPP_PORT,
     PAYMENT_WEBHOOK_SECRET
 )
-from src.main import handle_payment_webhook, on_startup, on_shutdown
+from src.main import handle_payment_webhook, payment_webhook_worker, on_startup, on_shutdown
 
 
 # Set webhook mode for testing
@@ -25,10 +30,11 @@ def mock_bot():
     return mock
 
 
-@pytest.fixture
-async def webhook_client():
-    """Create a test client for the webhook handler"""
+@pytest.fixture(scope="module")
+async def webhook_server_client():
+    """Start one test server and client for the module's webhook tests"""
     app = web.Application()
+    app['payment_webhook_queue'] = asyncio.Queue(maxsize=1)
     app.router.add_post('/payment-webhook', handle_payment_webhook)
     server = TestServer(app)
     client = TestClient(server)
@@ -37,23 +43,75 @@ async def webhook_client():
     await client.close()
 
 
-@pytest.mark.asyncio
-async def test_on_startup_sets_webhook(mock_bot):
+@pytest.fixture
+def webhook_client(webhook_server_client):
+    """The shared webhook client, with webhooks queued by earlier tests dropped"""
+    queue = webhook_server_client.server.app['payment_webhook_queue']
+    while not queue.empty():
+        queue.get_nowait()
+    return webhook_server_client
+
+
+def sign_webhook(body):
+    """Signature the payment gateway sends for a webhook body"""
+    return hmac.new(PAYMENT_WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+
+
+def make_webhook_request(body, signature=None):
+    """Build a payment webhook POST request for calling the handler directly.
+    
+    The request carries the raw body and an app with a one-slot webhook
+    queue, so the handler's error paths can be tested without a server.
+    """
+    app = web.Application()
+    app['payment_webhook_queue'] = asyncio.Queue(maxsize=1)
+    headers = {"Content-Type": "application/json"}
+    if signature is not None:
+        headers["X-Signature"] = signature
+    payload = MagicMock()
+    payload.readany = AsyncMock(side_effect=[body, b""])
+    return make_mocked_request(
+        "POST", "/payment-webhook", headers=headers, app=app, payload=payload
+    )
+
+
+@pytest.fixture
+def webhook_lifecycle(mock_bot):
+    """Run the startup and shutdown hooks in webhook mode against the mock bot.
+    
+    The config was loaded before WEBHOOK_MODE was set above, so the mode is
+    patched in src.main. The database, security, metric and scheduled task
+    hooks are replaced so the session's test database stays open.
+    """
+    with patch.multiple(
+        "src.main",
+        WEBHOOK_MODE=True,
+        bot=mock_bot,
+        init_db=AsyncMock(),
+        close_db=AsyncMock(),
+        start_security_tasks=AsyncMock(),
+        start_metric_writer=MagicMock(),
+        stop_metric_writer=AsyncMock(),
+        start_periodic_tasks=MagicMock(),
+        stop_periodic_tasks=AsyncMock(),
+    ):
+        yield mock_bot
+
+
+async def test_on_startup_sets_webhook(webhook_lifecycle):
     """Test that on_startup sets the webhook URL"""
-    await on_startup(mock_bot, WEBHOOK_URL)
-    mock_bot.set_webhook.assert_called_once_with(WEBHOOK_URL)
+    await on_startup()
+    webhook_lifecycle.set_webhook.assert_called_once_with(WEBHOOK_URL)
 
 
-@pytest.mark.asyncio
-async def test_on_shutdown_removes_webhook(mock_bot):
+async def test_on_shutdown_removes_webhook(webhook_lifecycle):
     """Test that on_shutdown removes the webhook"""
-    await on_shutdown(mock_bot)
-    mock_bot.delete_webhook.assert_called_once()
+    await on_shutdown()
+    webhook_lifecycle.delete_webhook.assert_called_once()
 
 
-@pytest.mark.asyncio
 async def test_payment_webhook_processing(webhook_client):
-    """Test that the payment webhook handler processes valid payments"""
+    """Test that the payment webhook handler queues valid payments"""
     # Mock payment data
     payment_data = {
         "status": "completed",
@@ -63,61 +121,142 @@ async def test_payment_webhook_processing(webhook_client):
         "currency": "KZT"
     }
     
-    # Mock webhook signature
+    body = json.dumps(payment_data).encode()
+    
+    # Sign the webhook the way the payment gateway does
     headers = {
-        "X-Signature": "test_signature"
+        "Content-Type": "application/json",
+        "X-Signature": sign_webhook(body)
     }
     
-    # Mock process_payment_webhook function
-    with patch("src.bot.process_payment_webhook", AsyncMock(return_value=True)):
-        # Send request to webhook endpoint
-        response = await webhook_client.post(
-            '/payment-webhook',
-            json=payment_data,
-            headers=headers
-        )
-        
-        # Check response
-        assert response.status == 200
-        response_data = await response.json()
-        assert response_data["status"] == "success"
-
-
-@pytest.mark.asyncio
-async def test_payment_webhook_error_handling(webhook_client):
-    """Test that the payment webhook handler handles errors properly"""
-    # Mock invalid payment data
-    payment_data = {
-        "status": "invalid",
-    }
+    # Send request to webhook endpoint
+    response = await webhook_client.post(
+        '/payment-webhook',
+        data=body,
+        headers=headers
+    )
+    
+    # Check response
+    assert response.status == 200
+    response_data = await response.json()
+    assert response_data["status"] == "success"
     
-    # Mock process_payment_webhook to raise an exception
-    with patch("src.bot.process_payment_webhook", AsyncMock(side_effect=Exception("Test error"))):
-        # Send request to webhook endpoint
-        response = await webhook_client.post('/payment-webhook', json=payment_data)
-        
-        # Check response
-        assert response.status == 400
-        response_data = await response.json()
-        assert response_data["status"] == "error"
-        assert "message" in response_data
+    # Check the webhook was queued for the workers
+    queue = webhook_client.server.app['payment_webhook_queue']
+    assert queue.get_nowait() == (payment_data, headers["X-Signature"])
 
 
-@pytest.mark.asyncio
 async def test_payment_webhook_invalid_signature(webhook_client):
     """Test that the payment webhook handler rejects invalid signatures"""
     # Mock payment data
     payment_data = {
         "status": "completed",
         "order_id": 123,
+        "payment_id": "payment_123",
     }
     
-    # Mock process_payment_webhook to return False for invalid signatures
-    with patch("src.bot.process_payment_webhook", AsyncMock(return_value=False)):
-        # Send request to webhook endpoint
-        response = await webhook_client.post('/payment-webhook', json=payment_data)
-        
-        # Check response
-        assert response.status == 400
-        response_data = await response.json()
-        assert response_data["status"] == "error" 
\ No newline at end of file
+    # Send request signed with the wrong secret
+    body = json.dumps(payment_data).encode()
+    forged_signature = hmac.new(b"wrong_secret", body, hashlib.sha256).hexdigest()
+    response = await webhook_client.post(
+        '/payment-webhook',
+        data=body,
+        headers={"Content-Type": "application/json", "X-Signature": forged_signature}
+    )
+    
+    # Check response
+    assert response.status == 401
+    response_data = await response.json()
+    assert response_data["status"] == "error"
+    
+    # Check the webhook never reached the workers
+    assert webhook_client.server.app['payment_webhook_queue'].empty()
+
+
+_VALID_WEBHOOK_BODY = json.dumps(
+    {"status": "completed", "order_id": 123, "payment_id": "payment_123"}
+).encode()
+
+# (body, sign the body, fill the queue first, expected status) for webhooks the handler rejects
+WEBHOOK_ERROR_CASES = [
+    # Body that is not valid JSON
+    (b"not json", True, False, 400),
+    # Valid webhook without a signature
+    (_VALID_WEBHOOK_BODY, False, False, 401),
+    # Signed webhook that doesn't name the payment
+    (json.dumps({"status": "completed", "order_id": 123}).encode(), True, False, 400),
+    # Valid webhook while the queue is full
+    (_VALID_WEBHOOK_BODY, True, True, 503),
+]
+
+
+@pytest.mark.parametrize(
+    "body, signed, fill_queue, expected_status",
+    WEBHOOK_ERROR_CASES,
+    ids=["malformed_payload", "missing_signature", "missing_payment_id", "queue_full"]
+)
+async def test_payment_webhook_error_handling(body, signed, fill_queue, expected_status):
+    """Test that the payment webhook handler rejects webhooks it can't accept"""
+    request = make_webhook_request(body, sign_webhook(body) if signed else None)
+    queue = request.app['payment_webhook_queue']
+    
+    if fill_queue:
+        # Fill the queue so the next webhook cannot be accepted
+        queue.put_nowait(({}, None))
+    
+    response = await handle_payment_webhook(request)
+    
+    # Check response
+    assert response.status == expected_status
+    response_data = json.loads(response.text)
+    assert response_data["status"] == "error"
+    assert "message" in response_data
+    
+    # Check nothing was queued for the workers
+    assert queue.qsize() == (1 if fill_queue else 0)
+
+
+# (payload, expected response status) for signed webhooks the handler answers
+# without an error; queued tells whether the workers get them
+WEBHOOK_ACCEPTED_CASES = [
+    # The order is found by its payment, so order_id isn't required
+    ({"status": "completed", "payment_id": "payment_123"}, "success", True),
+    # Payments that didn't complete are acknowledged but not processed
+    ({"status": "failed", "order_id": 123, "payment_id": "payment_123"}, "ignored", False),
+]
+
+
+@pytest.mark.parametrize(
+    "payment_data, expected_status, queued",
+    WEBHOOK_ACCEPTED_CASES,
+    ids=["without_order_id", "not_completed"]
+)
+async def test_payment_webhook_accepted(payment_data, expected_status, queued):
+    """Test that signed webhooks with a payment_id are acknowledged"""
+    body = json.dumps(payment_data).encode()
+    request = make_webhook_request(body, sign_webhook(body))
+    queue = request.app['payment_webhook_queue']
+    
+    response = await handle_payment_webhook(request)
+    
+    assert response.status == 200
+    assert json.loads(response.text)["status"] == expected_status
+    assert queue.qsize() == (1 if queued else 0)
+
+
+async def test_payment_webhook_worker_survives_errors():
+    """Test that a worker keeps draining the queue when processing fails"""
+    queue = asyncio.Queue()
+    queue.put_nowait(({"payment_id": "bad"}, None))
+    queue.put_nowait(({"payment_id": "good"}, "test_signature"))
+    
+    mock_process = AsyncMock(side_effect=[Exception("Test error"), True])
+    with patch("src.main.process_payment_webhook", mock_process):
+        worker = asyncio.create_task(payment_webhook_worker(queue))
+        await asyncio.wait_for(queue.join(), timeout=1)
+        worker.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await worker
+    
+    assert mock_process.await_count == 2
+    mock_process.assert_awaited_with({"payment_id": "good"}, "test_signature")
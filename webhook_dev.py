@@ -4,8 +4,6 @@ Development runner for the As Bolsyn bot with webhook support.
 For use with ngrok for local webhook testing.
 """
 import os
-import logging
-import sys
 
 # Force webhook mode for development testing
 os.environ["WEBHOOK_MODE"] = "True"
@@ -14,6 +12,10 @@ os.environ["WEBHOOK_MODE"] = "True"
 from src.main import app
 
 if __name__ == "__main__":
+    # Only needed when run directly, not when the app is imported
+    import logging
+    import sys
+    
     logging.basicConfig(level=logging.INFO)
     print("Starting bot in WEBHOOK mode for development testing...")
     